@@ -0,0 +1,111 @@
+"""
+Batch analysis of many positions on every CPU core. Positions go to a pool of worker processes as FEN strings, which
+are far cheaper to pickle than a GameState, and results come back as soon as each one is done. From the command line:
+
+    python ChessBatch.py positions.txt --mode search --depth 4 --workers 8
+
+reads one FEN per line and prints one JSON result per line, in the order the positions finish.
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+import ChessPerft
+import ChessSearch
+
+#set once per worker process by init_worker so tasks only carry (index, fen)
+_worker = {}
+
+
+def init_worker(mode, backend, depth, timeLimit, nodeLimit):
+    _worker["mode"] = mode
+    _worker["gs"] = ChessPerft.BACKENDS[backend]()
+    _worker["depth"] = depth
+    _worker["timeLimit"] = timeLimit
+    _worker["nodeLimit"] = nodeLimit
+    _worker["tt"] = ChessSearch.TranspositionTable() if mode == "search" else None
+
+
+'''
+Runs in a worker process, analyzes one position
+'''
+def analyze_task(task):
+    index, fen = task
+    gs = _worker["gs"]
+    result = {"index": index, "fen": fen}
+    startTime = time.perf_counter()
+    try:
+        gs.load_fen(fen)
+        if _worker["mode"] == "perft":
+            result["depth"] = _worker["depth"]
+            result["nodes"] = ChessPerft.perft(gs, _worker["depth"])
+        else:
+            search = ChessSearch.Search(gs, _worker["tt"])
+            bestMove, score = search.search(_worker["depth"], _worker["timeLimit"], _worker["nodeLimit"])
+            result["move"] = bestMove.get_chess_notation() if bestMove is not None else None
+            result["score"] = score
+            result["depth"] = search.completedDepth
+            result["nodes"] = search.nodes
+    except (ValueError, KeyError, IndexError) as e: #a bad FEN shouldn't take down the whole batch
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["seconds"] = round(time.perf_counter() - startTime, 4)
+    return result
+
+
+'''
+Analyzes an iterable of FEN strings on a process pool, yielding one result dict per position in completion order.
+Each result carries the position's index in the input so callers can put them back in order.
+mode is "search" (best move within depth/timeLimit/nodeLimit) or "perft" (node count to depth).
+'''
+def analyze_positions(fens, mode="search", depth=ChessSearch.MAX_PLY, timeLimit=None, nodeLimit=None,
+                      workers=None, backend="bitboard", chunksize=1):
+    if mode not in ("search", "perft"):
+        raise ValueError("mode must be 'search' or 'perft'")
+    if mode == "search" and depth == ChessSearch.MAX_PLY and timeLimit is None and nodeLimit is None:
+        raise ValueError("search needs a depth, timeLimit or nodeLimit")
+    with multiprocessing.Pool(workers, init_worker, (mode, backend, depth, timeLimit, nodeLimit)) as pool:
+        for result in pool.imap_unordered(analyze_task, enumerate(fens), chunksize):
+            yield result
+
+
+def read_fens(f):
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze many positions in parallel")
+    parser.add_argument("file", help="file with one FEN per line, - for stdin")
+    parser.add_argument("--mode", choices=["search", "perft"], default="search")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--movetime", type=float, default=None, help="seconds per position")
+    parser.add_argument("--nodes", type=int, default=None, help="node budget per position")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPUs")
+    parser.add_argument("--backend", choices=sorted(ChessPerft.BACKENDS), default="bitboard")
+    parser.add_argument("--chunksize", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    depth = args.depth
+    if depth is None:
+        depth = 3 if args.mode == "perft" or (args.movetime is None and args.nodes is None) else ChessSearch.MAX_PLY
+    f = sys.stdin if args.file == "-" else open(args.file)
+    try:
+        startTime = time.perf_counter()
+        count = 0
+        for result in analyze_positions(read_fens(f), args.mode, depth, args.movetime, args.nodes, args.workers,
+                                        args.backend, args.chunksize):
+            print(json.dumps(result), flush=True)
+            count += 1
+        sys.stderr.write("%d positions in %.3fs\n" % (count, time.perf_counter() - startTime))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
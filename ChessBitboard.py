@@ -0,0 +1,588 @@
+"""
+Bitboard backend for GameState. Every piece type of each color is stored as a 64-bit int, where bit (row*8 + col)
+is set when that piece is on (row, col). Move generation uses precomputed attack tables instead of walking
+the board square-by-square. The 8x8 board list is still kept up to date so the rest of the program can use it.
+
+Building a Move object costs more than finding the move, so legal_targets works on target bitboards and Move objects
+are only made by get_valid_moves. Code that just needs to count or walk moves (perft, batch analysis) can use
+count_legal_moves, generate_packed_moves and make_packed/undo_packed, which stay on ints.
+"""
+from ChessEngine import CASTLE_BK, CASTLE_BQ, CASTLE_RIGHTS_MASK, CASTLE_ROOK_COLS, CASTLE_WK, CASTLE_WQ, \
+    PROMOTION_CHOICES, PROMOTION_CODES, PROMOTION_PIECES, GameState, Move
+
+PIECES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WP, WN, WB, WR, WQ, WK, BP, BN, BB, BR, BQ, BK = range(12)
+
+FULL = (1 << 64) - 1
+#fields of a packed move, see Move.pack
+PROMOTION_MASK = 7 << 12
+ENPASSANT_FLAG = 1 << 15
+PROMOTION_CHOICE_CODES = [PROMOTION_CODES[piece] << 12 for piece in PROMOTION_CHOICES]
+PROMOTION_COUNT = len(PROMOTION_CHOICES)
+SQUARES = [(sq // 8, sq % 8) for sq in range(64)] #square index -> (row, col)
+ROW_MASKS = [0xFF << (8 * row) for row in range(8)]
+BACK_RANKS = ROW_MASKS[0] | ROW_MASKS[7]
+NOT_FILE_A = FULL ^ 0x0101010101010101 #everything but column 0
+NOT_FILE_H = FULL ^ 0x8080808080808080 #everything but column 7
+
+#ray directions as (row step, col step), the first four are rook directions, the last four bishop directions
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+#a direction is "positive" when walking it increases the square index, so the closest blocker is the lowest set bit
+POSITIVE = [d[0] * 8 + d[1] > 0 for d in DIRECTIONS]
+
+
+def _on_board(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def _step_attacks(shifts):
+    table = []
+    for sq in range(64):
+        r, c = SQUARES[sq]
+        bb = 0
+        for dr, dc in shifts:
+            if _on_board(r + dr, c + dc):
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _step_attacks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+#PAWN_ATTACKS[0] - squares a white pawn attacks, PAWN_ATTACKS[1] - squares a black pawn attacks
+PAWN_ATTACKS = [_step_attacks(((-1, -1), (-1, 1))), _step_attacks(((1, -1), (1, 1)))]
+
+#RAYS[d][sq] - every square from sq (exclusive) to the edge of the board in direction d
+RAYS = []
+for _d in DIRECTIONS:
+    _table = []
+    for _sq in range(64):
+        _r, _c = SQUARES[_sq]
+        _bb = 0
+        for _i in range(1, 8):
+            if not _on_board(_r + _d[0] * _i, _c + _d[1] * _i):
+                break
+            _bb |= 1 << ((_r + _d[0] * _i) * 8 + _c + _d[1] * _i)
+        _table.append(_bb)
+    RAYS.append(_table)
+
+#BETWEEN[a][b] - squares strictly between a and b when they share a line, otherwise 0
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _d in range(8):
+    for _sq in range(64):
+        _ray = RAYS[_d][_sq]
+        while _ray:
+            _to = (_ray & -_ray).bit_length() - 1
+            BETWEEN[_sq][_to] = RAYS[_d][_sq] & ~RAYS[_d][_to] & ~(1 << _to)
+            _ray &= _ray - 1
+
+
+def _ray_attacks(sq, d, occupied):
+    ray = RAYS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        if POSITIVE[d]:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= RAYS[d][blocker]
+    return ray
+
+
+#relevant occupancy masks for the sliding lookup, edge squares never change the result so they are left out
+def _relevant_mask(sq, directions):
+    mask = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        if ray:
+            #the square furthest from sq along the ray is the edge square
+            edge = 1 << (ray.bit_length() - 1) if POSITIVE[d] else ray & -ray
+            mask |= ray & ~edge
+    return mask
+
+
+#every square a rook or bishop on sq could reach on an empty board
+ROOK_LINES = [RAYS[0][sq] | RAYS[1][sq] | RAYS[2][sq] | RAYS[3][sq] for sq in range(64)]
+BISHOP_LINES = [RAYS[4][sq] | RAYS[5][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64)]
+ROOK_MASKS = [_relevant_mask(sq, range(0, 4)) for sq in range(64)]
+BISHOP_MASKS = [_relevant_mask(sq, range(4, 8)) for sq in range(64)]
+#sliding attack lookup tables, keyed by the relevant occupancy and filled the first time a pattern is seen
+ROOK_TABLE = [{} for _ in range(64)]
+BISHOP_TABLE = [{} for _ in range(64)]
+
+
+def rook_attacks(sq, occupied):
+    key = occupied & ROOK_MASKS[sq]
+    attacks = ROOK_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = _ray_attacks(sq, 0, key) | _ray_attacks(sq, 1, key) | _ray_attacks(sq, 2, key) | _ray_attacks(sq, 3, key)
+        ROOK_TABLE[sq][key] = attacks
+    return attacks
+
+
+def bishop_attacks(sq, occupied):
+    key = occupied & BISHOP_MASKS[sq]
+    attacks = BISHOP_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = _ray_attacks(sq, 4, key) | _ray_attacks(sq, 5, key) | _ray_attacks(sq, 6, key) | _ray_attacks(sq, 7, key)
+        BISHOP_TABLE[sq][key] = attacks
+    return attacks
+
+
+def lsb(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+if hasattr(int, "bit_count"): #python 3.10+
+    pop_count = int.bit_count
+else:
+    def pop_count(bb):
+        return bin(bb).count("1")
+
+
+class BitboardGameState(GameState):
+    '''
+    Drop in replacement for GameState that generates moves from bitboards
+    '''
+    def __init__(self):
+        GameState.__init__(self)
+        self.sync_bitboards()
+
+    '''
+    Rebuild every bitboard from self.board, call this after changing the board directly
+    '''
+    def sync_bitboards(self):
+        self.bitboards = [0] * 12
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.bitboards[PIECE_INDEX[piece]] |= 1 << (r * 8 + c)
+        self.update_occupancy()
+
+    def load_fen(self, fen):
+        GameState.load_fen(self, fen)
+        self.sync_bitboards()
+
+    def update_occupancy(self):
+        bb = self.bitboards
+        self.whiteOccupied = bb[WP] | bb[WN] | bb[WB] | bb[WR] | bb[WQ] | bb[WK]
+        self.blackOccupied = bb[BP] | bb[BN] | bb[BB] | bb[BR] | bb[BQ] | bb[BK]
+        self.occupied = self.whiteOccupied | self.blackOccupied
+
+    '''
+    Same as GameState.make_move, also keeps the bitboards in sync
+    '''
+    def make_move(self, move):
+        GameState.make_move(self, move)
+        self.toggle_move(move, self.board[move.end[0]][move.end[1]])
+
+    '''
+    Same as GameState.undo_move, also keeps the bitboards in sync
+    '''
+    def undo_move(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            self.toggle_move(move, self.board[move.end[0]][move.end[1]])
+            GameState.undo_move(self)
+
+    '''
+    Flips every bit a move changes, piecePlaced is the piece on the end square after the move. XOR undoes itself,
+    so the same call makes and takes back a move
+    '''
+    def toggle_move(self, move, piecePlaced):
+        bb = self.bitboards
+        startRow, startCol = move.start
+        endRow, endCol = move.end
+        startBit = 1 << (startRow * 8 + startCol)
+        endBit = 1 << (endRow * 8 + endCol)
+        bb[PIECE_INDEX[move.pieceMoved]] ^= startBit
+        bb[PIECE_INDEX[piecePlaced]] ^= endBit
+        moved = startBit | endBit
+        captured = 0
+        if move.pieceCaptured != "--":
+            captured = 1 << (startRow * 8 + endCol) if move.isEnpassantMove else endBit
+            bb[PIECE_INDEX[move.pieceCaptured]] ^= captured
+        elif move.isCastleMove:
+            rookStart, rookEnd = CASTLE_ROOK_COLS[endCol]
+            rookBits = 1 << (endRow * 8 + rookStart) | 1 << (endRow * 8 + rookEnd)
+            bb[PIECE_INDEX[move.pieceMoved[0] + "R"]] ^= rookBits
+            moved |= rookBits
+        if move.pieceMoved[0] == "w":
+            self.whiteOccupied ^= moved
+            self.blackOccupied ^= captured
+        else:
+            self.blackOccupied ^= moved
+            self.whiteOccupied ^= captured
+        self.occupied = self.whiteOccupied | self.blackOccupied
+
+    '''
+    Bitboard of the pieces of the given color (0 - white, 1 - black) that attack sq
+    '''
+    def attackers_to(self, sq, color, occupied):
+        bb = self.bitboards
+        o = 6 * color
+        return (PAWN_ATTACKS[1 - color][sq] & bb[o + WP]) | \
+               (KNIGHT_ATTACKS[sq] & bb[o + WN]) | \
+               (KING_ATTACKS[sq] & bb[o + WK]) | \
+               (rook_attacks(sq, occupied) & (bb[o + WR] | bb[o + WQ])) | \
+               (bishop_attacks(sq, occupied) & (bb[o + WB] | bb[o + WQ]))
+
+    '''
+    Legal moves of the side to move as bitboards of target squares, checks and pins are found once for the whole
+    position. Returns (targets, pawnTargets, promotions, specials):
+        targets - (from square, targets) for the king, knights, bishops, rooks and queens
+        pawnTargets, promotions - (offset, targets) of pawn moves, each from the target square minus offset, a
+            promotion target stands for one move per PROMOTION_CHOICES piece
+        specials - castling and en passant moves packed like Move.pack()
+    '''
+    def legal_targets(self):
+        bb = self.bitboards
+        us = 0 if self.whiteToMove else 1
+        them = 1 - us
+        o = 6 * us
+        e = 6 * them
+        ours = self.whiteOccupied if us == 0 else self.blackOccupied
+        theirs = self.blackOccupied if us == 0 else self.whiteOccupied
+        occupied = self.occupied
+        kingSq = bb[o + WK].bit_length() - 1 #the only bit
+        targets = []
+        pawnTargets = []
+        promotions = []
+        specials = []
+
+        enemyPawns = bb[e + WP]
+        enemyKnights = bb[e + WN]
+        enemyRooks = bb[e + WR] | bb[e + WQ]
+        enemyBishops = bb[e + WB] | bb[e + WQ]
+        #attackers_to written out, this runs for every position
+        checkers = (PAWN_ATTACKS[us][kingSq] & enemyPawns) | (KNIGHT_ATTACKS[kingSq] & enemyKnights) | \
+                   (rook_attacks(kingSq, occupied) & enemyRooks) | (bishop_attacks(kingSq, occupied) & enemyBishops)
+        self.inCheck = checkers != 0
+
+        #king moves, squares the enemy pawns, knights and king cover are ruled out all at once, then the sliders are
+        #checked per square with the king removed so it can't hide behind its own square
+        kingTargets = 0
+        candidates = KING_ATTACKS[kingSq] & ~ours
+        if candidates:
+            if us == 0:
+                danger = ((enemyPawns & NOT_FILE_A) << 7 | (enemyPawns & NOT_FILE_H) << 9) & FULL
+            else:
+                danger = (enemyPawns & NOT_FILE_A) >> 9 | (enemyPawns & NOT_FILE_H) >> 7
+            danger |= KING_ATTACKS[bb[e + WK].bit_length() - 1]
+            while enemyKnights:
+                bit = enemyKnights & -enemyKnights
+                enemyKnights ^= bit
+                danger |= KNIGHT_ATTACKS[bit.bit_length() - 1]
+            candidates &= ~danger
+            occupiedNoKing = occupied ^ (1 << kingSq)
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            to = bit.bit_length() - 1
+            if enemyRooks and rook_attacks(to, occupiedNoKing) & enemyRooks:
+                continue
+            if enemyBishops and bishop_attacks(to, occupiedNoKing) & enemyBishops:
+                continue
+            kingTargets |= bit
+        if kingTargets:
+            targets.append((kingSq, kingTargets))
+        if checkers & (checkers - 1): #double check, only the king can move
+            return targets, pawnTargets, promotions, specials
+        #castling, the squares between king and rook are empty and the king doesn't cross an attacked square. The
+        #square next to the king is safe when the king could step there, so only the square it lands on is looked at
+        rights = self.castlingRights & ((CASTLE_WK | CASTLE_WQ) if us == 0 else (CASTLE_BK | CASTLE_BQ))
+        if rights and not checkers and kingSq == (60 if us == 0 else 4):
+            if rights & (CASTLE_WK | CASTLE_BK) and bb[o + WR] >> (kingSq + 3) & 1 and \
+                    not occupied & (3 << (kingSq + 1)) and kingTargets >> (kingSq + 1) & 1 and \
+                    not self.attackers_to(kingSq + 2, them, occupied):
+                specials.append(kingSq | (kingSq + 2) << 6)
+            if rights & (CASTLE_WQ | CASTLE_BQ) and bb[o + WR] >> (kingSq - 4) & 1 and \
+                    not occupied & (7 << (kingSq - 3)) and kingTargets >> (kingSq - 1) & 1 and \
+                    not self.attackers_to(kingSq - 2, them, occupied):
+                specials.append(kingSq | (kingSq - 2) << 6)
+
+        #squares a non king piece may move to
+        if checkers:
+            checkMask = checkers | BETWEEN[kingSq][lsb(checkers)]
+        else:
+            checkMask = FULL
+
+        #pins, look from the king through our pieces to enemy sliders, if any share a line with the king
+        pinMasks = {}
+        snipers = 0
+        if ROOK_LINES[kingSq] & enemyRooks or BISHOP_LINES[kingSq] & enemyBishops:
+            snipers = (rook_attacks(kingSq, theirs) & enemyRooks) | (bishop_attacks(kingSq, theirs) & enemyBishops)
+        while snipers:
+            sniper = (snipers & -snipers).bit_length() - 1
+            snipers &= snipers - 1
+            between = BETWEEN[kingSq][sniper] & occupied
+            if between and not (between & (between - 1)) and between & ours:
+                pinMasks[lsb(between)] = BETWEEN[kingSq][sniper] | (1 << sniper)
+
+        notOurs = ~ours & checkMask
+        #knights, a pinned knight can never move
+        pieces = bb[o + WN]
+        while pieces:
+            sq = (pieces & -pieces).bit_length() - 1
+            pieces &= pieces - 1
+            if sq not in pinMasks:
+                moves = KNIGHT_ATTACKS[sq] & notOurs
+                if moves:
+                    targets.append((sq, moves))
+        #sliders, a queen gets one entry for its diagonal and one for its straight moves
+        pieces = bb[o + WB] | bb[o + WQ]
+        while pieces:
+            sq = (pieces & -pieces).bit_length() - 1
+            pieces &= pieces - 1
+            moves = BISHOP_TABLE[sq].get(occupied & BISHOP_MASKS[sq]) #bishop_attacks without the call
+            if moves is None:
+                moves = bishop_attacks(sq, occupied)
+            moves &= notOurs & pinMasks.get(sq, FULL)
+            if moves:
+                targets.append((sq, moves))
+        pieces = bb[o + WR] | bb[o + WQ]
+        while pieces:
+            sq = (pieces & -pieces).bit_length() - 1
+            pieces &= pieces - 1
+            moves = ROOK_TABLE[sq].get(occupied & ROOK_MASKS[sq])
+            if moves is None:
+                moves = rook_attacks(sq, occupied)
+            moves &= notOurs & pinMasks.get(sq, FULL)
+            if moves:
+                targets.append((sq, moves))
+        #pawns, the ones that aren't pinned are moved all at once by shifting the whole bitboard
+        empty = ~occupied & FULL
+        pawns = bb[o + WP]
+        pinnedPawns = 0
+        for sq in pinMasks:
+            pinnedPawns |= pawns & (1 << sq)
+        free = pawns ^ pinnedPawns
+        if us == 0:
+            single = free >> 8 & empty
+            pawnSets = ((-8, single), (-16, (single & ROW_MASKS[5]) >> 8 & empty),
+                        (-9, (free & NOT_FILE_A) >> 9 & theirs), (-7, (free & NOT_FILE_H) >> 7 & theirs))
+        else:
+            single = free << 8 & empty
+            pawnSets = ((8, single), (16, (single & ROW_MASKS[2]) << 8 & empty),
+                        (7, (free & NOT_FILE_A) << 7 & theirs), (9, (free & NOT_FILE_H) << 9 & theirs))
+        for offset, bits in pawnSets:
+            bits &= checkMask
+            if bits & BACK_RANKS:
+                promotions.append((offset, bits & BACK_RANKS))
+                bits &= ~BACK_RANKS
+            if bits:
+                pawnTargets.append((offset, bits))
+        #a pinned pawn can still move along the pin
+        step = -8 if us == 0 else 8
+        startRow = 6 if us == 0 else 1
+        while pinnedPawns:
+            sq = (pinnedPawns & -pinnedPawns).bit_length() - 1
+            pinnedPawns &= pinnedPawns - 1
+            moves = PAWN_ATTACKS[us][sq] & theirs
+            one = sq + step
+            if (1 << one) & empty:
+                moves |= 1 << one
+                if sq >> 3 == startRow and (1 << (one + step)) & empty:
+                    moves |= 1 << (one + step)
+            moves &= checkMask & pinMasks[sq]
+            while moves:
+                to = (moves & -moves).bit_length() - 1
+                moves &= moves - 1
+                (promotions if (1 << to) & BACK_RANKS else pawnTargets).append((to - sq, 1 << to))
+        #en passant, tried by taking both pawns off the board since that can open a rank to the king
+        if self.enpassantPossible != ():
+            epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+            capturedSq = epSq - step
+            #a check from anything but the pawn that just moved can't be answered by taking it
+            if not checkers & ~(1 << capturedSq):
+                pieces = PAWN_ATTACKS[them][epSq] & bb[o + WP]
+                while pieces:
+                    sq = (pieces & -pieces).bit_length() - 1
+                    pieces &= pieces - 1
+                    occupiedAfter = occupied ^ (1 << sq) ^ (1 << capturedSq) | (1 << epSq)
+                    if not (rook_attacks(kingSq, occupiedAfter) & (bb[e + WR] | bb[e + WQ])) and \
+                            not (bishop_attacks(kingSq, occupiedAfter) & (bb[e + WB] | bb[e + WQ])):
+                        specials.append(sq | epSq << 6 | 1 << 15)
+        return targets, pawnTargets, promotions, specials
+
+    '''
+    All legal moves as Move objects
+    '''
+    def generate_valid_moves(self, moves):
+        targets, pawnTargets, promotions, specials = self.legal_targets()
+        board = self.board
+        for sq, bits in targets:
+            start = SQUARES[sq]
+            while bits:
+                to = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                moves.append(Move(start, SQUARES[to], board))
+        for offset, bits in pawnTargets:
+            while bits:
+                to = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                moves.append(Move(SQUARES[to - offset], SQUARES[to], board))
+        for offset, bits in promotions:
+            while bits:
+                to = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                for piece in PROMOTION_CHOICES:
+                    moves.append(Move(SQUARES[to - offset], SQUARES[to], board, promotionPiece=piece))
+        for packed in specials:
+            moves.append(Move.unpack(packed, board))
+        return moves
+
+    '''
+    All legal moves packed like Move.pack(), without building Move objects
+    '''
+    def generate_packed_moves(self, moves=None):
+        if moves is None:
+            moves = []
+        targets, pawnTargets, promotions, specials = self.legal_targets()
+        for sq, bits in targets:
+            while bits:
+                to = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                moves.append(sq | to << 6)
+        for offset, bits in pawnTargets:
+            while bits:
+                to = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                moves.append((to - offset) | to << 6)
+        for offset, bits in promotions:
+            while bits:
+                to = (bits & -bits).bit_length() - 1
+                bits &= bits - 1
+                for code in PROMOTION_CHOICE_CODES:
+                    moves.append((to - offset) | to << 6 | code)
+        moves.extend(specials)
+        return moves
+
+    '''
+    Number of legal moves, counted from the target bitboards without listing the moves
+    '''
+    def count_legal_moves(self):
+        targets, pawnTargets, promotions, specials = self.legal_targets()
+        count = len(specials)
+        for sq, bits in targets:
+            count += pop_count(bits)
+        for offset, bits in pawnTargets:
+            count += pop_count(bits)
+        for offset, bits in promotions:
+            count += pop_count(bits) * PROMOTION_COUNT
+        return count
+
+    '''
+    Plays a packed move on the board and the bitboards only, the hash, evaluation, clocks and moveLog are left as
+    they are. Returns the record undo_packed needs. Meant for tight loops like perft that restore the position before
+    anything else looks at it
+    '''
+    def make_packed(self, packed):
+        board = self.board
+        bb = self.bitboards
+        start = packed & 63
+        end = packed >> 6 & 63
+        startRow, startCol = SQUARES[start]
+        endRow, endCol = SQUARES[end]
+        pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol]
+        record = (pieceCaptured, self.castlingRights, self.enpassantPossible, self.whiteOccupied, self.blackOccupied)
+        piecePlaced = pieceMoved[0] + PROMOTION_PIECES[packed >> 12 & 7] if packed & PROMOTION_MASK else pieceMoved
+        startBit = 1 << start
+        endBit = 1 << end
+        bb[PIECE_INDEX[pieceMoved]] ^= startBit
+        bb[PIECE_INDEX[piecePlaced]] ^= endBit
+        board[startRow][startCol] = "--"
+        board[endRow][endCol] = piecePlaced
+        moved = startBit | endBit
+        captured = 0
+        if pieceCaptured != "--":
+            bb[PIECE_INDEX[pieceCaptured]] ^= endBit
+            captured = endBit
+        elif packed & ENPASSANT_FLAG:
+            captured = 1 << (startRow * 8 + endCol)
+            bb[PIECE_INDEX[board[startRow][endCol]]] ^= captured
+            board[startRow][endCol] = "--"
+        elif pieceMoved[1] == "K" and (end - start == 2 or start - end == 2):
+            rookStart, rookEnd = CASTLE_ROOK_COLS[endCol]
+            rookBits = 1 << (endRow * 8 + rookStart) | 1 << (endRow * 8 + rookEnd)
+            bb[PIECE_INDEX[pieceMoved[0] + "R"]] ^= rookBits
+            board[endRow][rookEnd] = board[endRow][rookStart]
+            board[endRow][rookStart] = "--"
+            moved |= rookBits
+        if self.whiteToMove:
+            self.whiteOccupied ^= moved
+            self.blackOccupied ^= captured
+        else:
+            self.blackOccupied ^= moved
+            self.whiteOccupied ^= captured
+        self.occupied = self.whiteOccupied | self.blackOccupied
+        self.castlingRights &= CASTLE_RIGHTS_MASK[start] & CASTLE_RIGHTS_MASK[end]
+        self.enpassantPossible = ()
+        if pieceMoved[1] == "P" and (end - start == 16 or start - end == 16):
+            #same rule as make_move, only when an enemy pawn can take there
+            epSq = (start + end) >> 1
+            if PAWN_ATTACKS[0 if self.whiteToMove else 1][epSq] & bb[BP if self.whiteToMove else WP]:
+                self.enpassantPossible = SQUARES[epSq]
+        self.whiteToMove = not self.whiteToMove
+        return record
+
+    '''
+    Takes back make_packed(packed), record is what it returned
+    '''
+    def undo_packed(self, packed, record):
+        board = self.board
+        bb = self.bitboards
+        pieceCaptured, self.castlingRights, self.enpassantPossible, self.whiteOccupied, self.blackOccupied = record
+        self.occupied = self.whiteOccupied | self.blackOccupied
+        self.whiteToMove = not self.whiteToMove
+        start = packed & 63
+        end = packed >> 6 & 63
+        startRow, startCol = SQUARES[start]
+        endRow, endCol = SQUARES[end]
+        piecePlaced = board[endRow][endCol]
+        pieceMoved = piecePlaced[0] + "P" if packed & PROMOTION_MASK else piecePlaced
+        startBit = 1 << start
+        endBit = 1 << end
+        bb[PIECE_INDEX[pieceMoved]] ^= startBit
+        bb[PIECE_INDEX[piecePlaced]] ^= endBit
+        board[startRow][startCol] = pieceMoved
+        board[endRow][endCol] = pieceCaptured
+        if pieceCaptured != "--":
+            bb[PIECE_INDEX[pieceCaptured]] ^= endBit
+        elif packed & ENPASSANT_FLAG:
+            enemyPawn = "bP" if pieceMoved == "wP" else "wP"
+            bb[PIECE_INDEX[enemyPawn]] ^= 1 << (startRow * 8 + endCol)
+            board[startRow][endCol] = enemyPawn
+        elif pieceMoved[1] == "K" and (end - start == 2 or start - end == 2):
+            rookStart, rookEnd = CASTLE_ROOK_COLS[endCol]
+            bb[PIECE_INDEX[pieceMoved[0] + "R"]] ^= 1 << (endRow * 8 + rookStart) | 1 << (endRow * 8 + rookEnd)
+            board[endRow][rookStart] = board[endRow][rookEnd]
+            board[endRow][rookEnd] = "--"
+
+    '''
+    Leaf nodes depth plies below the current position, on packed moves with bulk counting at the last ply. The
+    position is the same afterwards
+    '''
+    def perft(self, depth):
+        if depth <= 0:
+            return 1
+        if depth == 1:
+            return self.count_legal_moves()
+        nodes = 0
+        make_packed = self.make_packed
+        undo_packed = self.undo_packed
+        if depth == 2: #most of the work, count the replies straight away
+            count_legal_moves = self.count_legal_moves
+            for packed in self.generate_packed_moves():
+                record = make_packed(packed)
+                nodes += count_legal_moves()
+                undo_packed(packed, record)
+            return nodes
+        for packed in self.generate_packed_moves():
+            record = make_packed(packed)
+            nodes += self.perft(depth - 1)
+            undo_packed(packed, record)
+        return nodes
@@ -0,0 +1,168 @@
+"""
+Opening book stored as a sorted binary file. Each record is (Zobrist key, packed move, weight) and records are sorted
+by key, so a lookup is a binary search over the memory-mapped file. Worker processes that open the same book share
+one copy of it in the OS page cache. Build a book from PGN files with:
+
+    python ChessBook.py build book.bin games1.pgn games2.pgn --plies 20
+    python ChessBook.py probe book.bin "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+The file format only knows about position keys and moves, so it works for any position -> move table,
+endgame tables included.
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+
+import ChessEngine
+import ChessPGN
+
+MAGIC = b"PYCBOOK2" #version 2 keys include castling rights, books built before that need rebuilding
+HEADER = struct.Struct("<8sQ") #magic, number of records
+RECORD = struct.Struct("<QHI") #zobrist key, packed move, weight
+KEY = struct.Struct("<Q")
+
+
+'''
+Writes (key, packedMove, weight) entries to path as a book file
+'''
+def write_book(path, entries):
+    entries = sorted(entries)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key, packedMove, weight in entries:
+            f.write(RECORD.pack(key, packedMove, min(weight, 0xFFFFFFFF)))
+    return len(entries)
+
+
+'''
+Counts how often each move was played from each position in the first maxPlies plies of the games
+'''
+def collect_moves(games, maxPlies=20, counts=None):
+    if counts is None:
+        counts = {}
+    for game in games:
+        try:
+            gs = game.get_start_state()
+            for move in replay_before(game, gs, maxPlies):
+                entry = (gs.zobristKey, move.pack())
+                counts[entry] = counts.get(entry, 0) + 1
+        except ValueError: #illegal or unreadable move, keep what was read before it
+            continue
+    return counts
+
+
+'''
+Like PGNGame.replay but yields each move before it is made, so the key on gs is the position the move is played from
+'''
+def replay_before(game, gs, maxPlies):
+    moves = []
+    for san in game.moves[:maxPlies]:
+        move = ChessPGN.parse_san(gs, san, gs.get_valid_moves(moves))
+        yield move
+        gs.make_move(move)
+
+
+def build_book(path, pgnPaths, maxPlies=20, minCount=1):
+    counts = {}
+    for pgnPath in pgnPaths:
+        with open(pgnPath, errors="replace") as f:
+            collect_moves(ChessPGN.read_games(f), maxPlies, counts)
+    return write_book(path, [(key, packedMove, weight) for (key, packedMove), weight in counts.items()
+                             if weight >= minCount])
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("not a book file: " + path)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    '''
+    All (packedMove, weight) records for a key
+    '''
+    def lookup(self, key):
+        data = self.data
+        lo = 0
+        hi = self.size
+        while lo < hi: #first record with a key >= key
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(data, HEADER.size + mid * RECORD.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        records = []
+        while lo < self.size:
+            recordKey, packedMove, weight = RECORD.unpack_from(data, HEADER.size + lo * RECORD.size)
+            if recordKey != key:
+                break
+            records.append((packedMove, weight))
+            lo += 1
+        return records
+
+    '''
+    Book moves for the position in gs as (Move, weight), moves that aren't legal there (a key collision) are dropped
+    '''
+    def get_moves(self, gs):
+        records = self.lookup(gs.zobristKey)
+        if not records:
+            return []
+        validMoves = {move.moveID: move for move in gs.get_valid_moves()}
+        bookMoves = []
+        for packedMove, weight in records:
+            move = ChessEngine.Move.unpack(packedMove, gs.board)
+            if move.moveID in validMoves:
+                bookMoves.append((validMoves[move.moveID], weight))
+        return bookMoves
+
+    '''
+    A book move picked at random in proportion to its weight, or None when the position isn't in the book
+    '''
+    def choose_move(self, gs, rng=random):
+        bookMoves = self.get_moves(gs)
+        if not bookMoves:
+            return None
+        return rng.choices([move for move, weight in bookMoves], [weight for move, weight in bookMoves])[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("book")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("--plies", type=int, default=20, help="only the first PLIES plies of each game")
+    build.add_argument("--min-count", type=int, default=1, help="drop moves played fewer times than this")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book")
+    probe.add_argument("fen")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build_book(args.book, args.pgn, args.plies, args.min_count)
+        print("%d records written to %s" % (count, args.book))
+    else:
+        gs = ChessEngine.GameState()
+        gs.load_fen(args.fen)
+        with OpeningBook(args.book) as book:
+            for move, weight in sorted(book.get_moves(gs), key=lambda entry: -entry[1]):
+                print(ChessPGN.get_san(gs, move), weight)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
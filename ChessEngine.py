@@ -2,9 +2,49 @@
 This class is responsible for storing all the information about the current state of a chess game.
 It will aslo be responsible for determining the valid moves at the current state. It will also keep a move log
 """
+import random
+from collections import OrderedDict
+
+import ChessEvaluation
+
+#Zobrist keys, fixed seed so a position hashes the same in every process
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = {color + piece: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                  for color in "wb" for piece in "PNBRQK"}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(16)] #indexed by the castling rights bits
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)] #indexed by file
+
+#castling rights bits, bit i stands for CASTLE_FLAGS[i] in a FEN string
+CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ = 1, 2, 4, 8
+CASTLE_FLAGS = "KQkq"
+#rights kept by a move from or to each square (row * 8 + col), moving a king or rook or taking a rook loses them
+CASTLE_RIGHTS_MASK = [15] * 64
+CASTLE_RIGHTS_MASK[0] = 15 & ~CASTLE_BQ
+CASTLE_RIGHTS_MASK[4] = 15 & ~(CASTLE_BK | CASTLE_BQ)
+CASTLE_RIGHTS_MASK[7] = 15 & ~CASTLE_BK
+CASTLE_RIGHTS_MASK[56] = 15 & ~CASTLE_WQ
+CASTLE_RIGHTS_MASK[60] = 15 & ~(CASTLE_WK | CASTLE_WQ)
+CASTLE_RIGHTS_MASK[63] = 15 & ~CASTLE_WK
+#column the king lands on when castling -> (rook start column, rook end column)
+CASTLE_ROOK_COLS = {6: (7, 5), 2: (0, 3)}
+PROMOTION_CHOICES = ("Q", "N", "R", "B") #pieces a pawn can promote to, in the order moves are generated
+UNDO_STACK_SIZE = 256 #plies of undo records allocated up front, doubled if a game gets longer
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+MG_SCORES = ChessEvaluation.MG_SCORES
+EG_SCORES = ChessEvaluation.EG_SCORES
+PHASE = ChessEvaluation.PHASE
+
+
 class GameState():
+    #(row, col) steps, the first four directions are rook directions, the last four bishop directions
+    directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+    knightShifts = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+    kingShifts = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
     def __init__(self):
-        #possible improvment - using numPy arrays
+        #for many positions at once as numPy arrays see ChessNumpy.PositionBatch
         #using 8x8 2-D list, each element has two characters
         #   1st char - color of piece: "b" or "w"
         #   2nd char - type of piece: "R", "N", "B", "Q", "K", or "P"
@@ -28,32 +68,256 @@ class GameState():
         self.inCheck = False
         self.staleMate = False
         self.enpassantPossible = () #coordinates for the square where en passant capture is possible
+        self.castlingRights = CASTLE_WK | CASTLE_WQ | CASTLE_BK | CASTLE_BQ
+        self.halfmoveClock = 0 #plies since the last capture or pawn move, for the fifty move rule
         self.pins = []
+        self.pinDirections = {} #(row, col) of a pinned piece -> direction of the pin
         self.checks = []
+        self.fullmoveStart = 1 #full move number of the position the game started from
+        self.startFen = START_FEN #position before the first move in moveLog, with it the game can be replayed
+        self.mgScore, self.egScore, self.phase = ChessEvaluation.score_board(self.board) #running evaluation totals
+        self.zobristKey = self.compute_zobrist_key()
+        self.repetitionCounts = {self.zobristKey: 1} #key -> times the position has occurred
+        #one record per ply in moveLog with the state a move can't give back by itself, see make_move
+        self.undoStack = [None] * UNDO_STACK_SIZE
+        self.moveCache = None #MoveCache of legal moves by zobristKey, off unless enable_move_cache is called
+
+    '''
+    Sets up the position from a FEN string
+    '''
+    def load_fen(self, fen):
+        fields = fen.split()
+        rows = fields[0].split("/") if fields else []
+        if len(fields) < 2 or len(rows) != 8:
+            raise ValueError("invalid FEN: " + fen)
+        #everything is checked before the state is touched, so a bad FEN leaves the old position as it was
+        board = []
+        whiteKings = []
+        blackKings = []
+        for rank in rows:
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(["--"] * int(ch))
+                elif ch.upper() not in "PNBRQK":
+                    raise ValueError("invalid FEN: " + fen)
+                else:
+                    row.append(("w" if ch.isupper() else "b") + ch.upper())
+                    if ch == "K":
+                        whiteKings.append((len(board), len(row) - 1))
+                    elif ch == "k":
+                        blackKings.append((len(board), len(row) - 1))
+            if len(row) != 8:
+                raise ValueError("invalid FEN: " + fen)
+            board.append(row)
+        #move generation needs the kings, don't let a missing one fall back on the last position's
+        if len(whiteKings) != 1 or len(blackKings) != 1:
+            raise ValueError("invalid FEN, needs one king per side: " + fen)
+        #a pawn on the back rank would step off the board
+        if any(piece[1] == "P" for piece in board[0] + board[7]):
+            raise ValueError("invalid FEN, pawn on the first or eighth rank: " + fen)
+        castlingRights = 0
+        for ch in fields[2] if len(fields) > 2 else "-":
+            if ch in CASTLE_FLAGS:
+                castlingRights |= 1 << CASTLE_FLAGS.index(ch)
+            elif ch != "-":
+                raise ValueError("invalid FEN: " + fen)
+        whiteToMove = fields[1] == "w"
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        enpassantPossible = ()
+        if enpassant != "-":
+            #the square behind a pawn that just moved two, rank 6 with white to move and rank 3 with black
+            if len(enpassant) != 2 or enpassant[0] not in Move.filesToCols or \
+                    enpassant[1] != ("6" if whiteToMove else "3"):
+                raise ValueError("invalid FEN, bad en passant square: " + fen)
+            epRow, epCol = Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]]
+            #same rule as make_move, keep the square only if a pawn can take there so the hash matches the game's
+            pawnRow = epRow + (1 if whiteToMove else -1)
+            ownPawn = ("w" if whiteToMove else "b") + "P"
+            if (epCol > 0 and board[pawnRow][epCol - 1] == ownPawn) or \
+                    (epCol < 7 and board[pawnRow][epCol + 1] == ownPawn):
+                enpassantPossible = (epRow, epCol)
+        halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        fullmoveStart = int(fields[5]) if len(fields) > 5 else 1
+        self.board = board
+        self.whiteKingLocation = whiteKings[0]
+        self.blackKingLocation = blackKings[0]
+        self.whiteToMove = whiteToMove
+        self.castlingRights = castlingRights
+        self.enpassantPossible = enpassantPossible
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveStart = fullmoveStart
+        self.moveLog = []
+        self.inCheck = False
+        self.staleMate = False
+        self.mgScore, self.egScore, self.phase = ChessEvaluation.score_board(self.board)
+        self.zobristKey = self.compute_zobrist_key()
+        self.repetitionCounts = {self.zobristKey: 1}
+        self.startFen = self.get_fen()
+
+    '''
+    FEN string of the current position
+    '''
+    def get_fen(self):
+        rows = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            rows.append(rank)
+        if self.enpassantPossible == ():
+            enpassant = "-"
+        else:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        castling = "".join(flag for i, flag in enumerate(CASTLE_FLAGS) if self.castlingRights >> i & 1) or "-"
+        return " ".join(["/".join(rows), "w" if self.whiteToMove else "b", castling, enpassant,
+                         str(self.halfmoveClock), str(self.get_fullmove_number())])
+
+    '''
+    Full move number as written in FEN and PGN, it goes up by one after every black move
+    '''
+    def get_fullmove_number(self):
+        plies = len(self.moveLog)
+        startedWhite = self.whiteToMove == (plies % 2 == 0)
+        return self.fullmoveStart + (plies // 2 if startedWhite else (plies + 1) // 2)
 
     '''
-    Takes a move as a parameter and exectues it ( will not work with castling, pawn promotion, en-passant)
+    Hashes the whole position from scratch, make_move and undo_move keep self.zobristKey up to date incrementally
+    '''
+    def compute_zobrist_key(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r * 8 + c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRights]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key
+
+    '''
+    Number of times the current position has occurred in this game, including now
+    '''
+    def get_repetition_count(self):
+        return self.repetitionCounts.get(self.zobristKey, 0)
+
+    '''
+    Takes a move as a parameter and exectues it, including castling, en passant and promotion. What undo_move can't
+    get back from the move itself (castling rights, en passant square, halfmove clock, hash and evaluation totals)
+    is written to the preallocated undoStack, so neither call copies the board
     '''
     def make_move(self, move):
-        self.board[move.end[0]][move.end[1]] = move.pieceMoved
-        self.board[move.start[0]][move.start[1]] = "--"
+        board = self.board
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.extend([None] * ply)
+        self.undoStack[ply] = (self.castlingRights, self.enpassantPossible, self.halfmoveClock, self.zobristKey,
+                               self.mgScore, self.egScore, self.phase)
+        startRow, startCol = move.start
+        endRow, endCol = move.end
+        pieceMoved = move.pieceMoved
+        pieceCaptured = move.pieceCaptured
+        piecePlaced = pieceMoved[0] + move.promotionPiece if move.isPawnPromotion else pieceMoved
+        board[startRow][startCol] = "--"
+        board[endRow][endCol] = piecePlaced
         self.moveLog.append(move) #log to undo later or print moveLog
         self.whiteToMove = not self.whiteToMove #swap players
-        if move.pieceMoved == "wK":
+        if pieceMoved == "wK":
             self.whiteKingLocation = move.end
-        elif move.pieceMoved == "bK":
+        elif pieceMoved == "bK":
             self.blackKingLocation = move.end
-        #pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.end[0]][move.end[1]] = move.pieceMoved[0] + "Q"
+        #update the hash and evaluation with what changed
+        startSq = startRow * 8 + startCol
+        endSq = endRow * 8 + endCol
+        mg = MG_SCORES[piecePlaced][endSq] - MG_SCORES[pieceMoved][startSq]
+        eg = EG_SCORES[piecePlaced][endSq] - EG_SCORES[pieceMoved][startSq]
+        phase = PHASE[piecePlaced] - PHASE[pieceMoved]
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[pieceMoved][startSq] ^ ZOBRIST_PIECES[piecePlaced][endSq]
+        if pieceCaptured != "--":
+            if move.isEnpassantMove: #the captured pawn is next to the start square, not on the end square
+                board[startRow][endCol] = "--"
+                capturedSq = startRow * 8 + endCol
+            else:
+                capturedSq = endSq
+            mg -= MG_SCORES[pieceCaptured][capturedSq]
+            eg -= EG_SCORES[pieceCaptured][capturedSq]
+            phase -= PHASE[pieceCaptured]
+            key ^= ZOBRIST_PIECES[pieceCaptured][capturedSq]
+        elif move.isCastleMove: #the rook jumps over to the other side of the king
+            rookStart, rookEnd = CASTLE_ROOK_COLS[endCol]
+            rook = board[endRow][rookStart]
+            board[endRow][rookStart] = "--"
+            board[endRow][rookEnd] = rook
+            rookStartSq = endRow * 8 + rookStart
+            rookEndSq = endRow * 8 + rookEnd
+            mg += MG_SCORES[rook][rookEndSq] - MG_SCORES[rook][rookStartSq]
+            eg += EG_SCORES[rook][rookEndSq] - EG_SCORES[rook][rookStartSq]
+            key ^= ZOBRIST_PIECES[rook][rookStartSq] ^ ZOBRIST_PIECES[rook][rookEndSq]
+        self.mgScore += mg
+        self.egScore += eg
+        self.phase += phase
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+            self.enpassantPossible = ()
+        if pieceMoved[1] == "P":
+            self.halfmoveClock = 0
+            #only remember the en passant square when a pawn can take there, so the position hashes the same as
+            #one where the pawn arrived some other way
+            if abs(endRow - startRow) == 2:
+                enemyPawn = ("b" if pieceMoved[0] == "w" else "w") + "P"
+                if (endCol > 0 and board[endRow][endCol - 1] == enemyPawn) or \
+                        (endCol < 7 and board[endRow][endCol + 1] == enemyPawn):
+                    self.enpassantPossible = ((startRow + endRow) // 2, endCol)
+                    key ^= ZOBRIST_ENPASSANT[endCol]
+        elif pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        rights = self.castlingRights & CASTLE_RIGHTS_MASK[startSq] & CASTLE_RIGHTS_MASK[endSq]
+        if rights != self.castlingRights:
+            key ^= ZOBRIST_CASTLING[self.castlingRights] ^ ZOBRIST_CASTLING[rights]
+            self.castlingRights = rights
+        self.zobristKey = key
+        self.repetitionCounts[key] = self.repetitionCounts.get(key, 0) + 1
+
     '''
     Undo the last move made
     '''
     def undo_move(self):
         if len(self.moveLog) != 0: #there is a move to undo
             move = self.moveLog.pop()
-            self.board[move.start[0]][move.start[1]] = move.pieceMoved
-            self.board[move.end[0]][move.end[1]] = move.pieceCaptured
+            count = self.repetitionCounts[self.zobristKey] - 1
+            if count:
+                self.repetitionCounts[self.zobristKey] = count
+            else:
+                del self.repetitionCounts[self.zobristKey]
+            (self.castlingRights, self.enpassantPossible, self.halfmoveClock, self.zobristKey,
+             self.mgScore, self.egScore, self.phase) = self.undoStack[len(self.moveLog)]
+            board = self.board
+            endRow, endCol = move.end
+            board[move.start[0]][move.start[1]] = move.pieceMoved
+            if move.isEnpassantMove:
+                board[endRow][endCol] = "--"
+                board[move.start[0]][endCol] = move.pieceCaptured
+            else:
+                board[endRow][endCol] = move.pieceCaptured
+            if move.isCastleMove:
+                rookStart, rookEnd = CASTLE_ROOK_COLS[endCol]
+                board[endRow][rookStart] = board[endRow][rookEnd]
+                board[endRow][rookEnd] = "--"
             self.whiteToMove = not self.whiteToMove
             if move.pieceMoved == "wK":
                 self.whiteKingLocation = move.start
@@ -61,11 +325,41 @@ class GameState():
                 self.blackKingLocation = move.start
 
     '''
-    All moves considering checks
+    Remember the legal moves of up to size positions, so going back to a position (undo, replaying a game) doesn't
+    generate its moves again. Entries are keyed by position hash so make_move/undo_move never leave them stale
+    '''
+    def enable_move_cache(self, size=4096):
+        self.moveCache = MoveCache(size)
+        return self.moveCache
+
+    def disable_move_cache(self):
+        self.moveCache = None
+
+    '''
+    All moves considering checks. Pass in a list to have it cleared and filled instead of allocating a new one
+    '''
+    def get_valid_moves(self, moves=None):
+        if moves is None:
+            moves = []
+        else: #reuse the caller's list
+            moves.clear()
+        if self.moveCache is None:
+            return self.generate_valid_moves(moves)
+        entry = self.moveCache.get(self.zobristKey)
+        if entry is not None:
+            self.inCheck = entry[0]
+            moves.extend(entry[1])
+            return moves
+        self.generate_valid_moves(moves)
+        self.moveCache.put(self.zobristKey, (self.inCheck, tuple(moves)))
+        return moves
+
+    '''
+    Fills moves with the legal moves of the current position, get_valid_moves calls this on a cache miss
     '''
-    def get_valid_moves(self):
-        moves = []
+    def generate_valid_moves(self, moves):
         self.inCheck, self.pins, self.checks = self.check_pins_checks()
+        self.pinDirections = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in self.pins}
         if self.whiteToMove:
             kingRow = self.whiteKingLocation[0]
             kingCol = self.whiteKingLocation[1]
@@ -74,37 +368,37 @@ class GameState():
             kingCol = self.blackKingLocation[1]
         if self.inCheck:
             if len(self.checks) == 1: #only checked by one piece
-                moves = self.get_all_possible_moves()
+                self.get_all_possible_moves(moves)
                 check = self.checks[0]
                 checkRow = check[0]
                 checkCol = check[1]
                 pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []
+                validSquares = set()
                 if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
+                    validSquares.add((checkRow, checkCol))
                 else:
                     for i in range(1, 8):
                         validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSquares.append(validSquare)
+                        validSquares.add(validSquare)
                         if validSquare[0] == checkRow and validSquare[1] == checkCol:
                             break
-                #get rid of any moves that dont block check or move kig
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K': #move doesnt block king
-                        if not (moves[i].end[0], moves[i].end[1]) in validSquares:
-                            moves.remove(moves[i])
+                #get rid of any moves that dont block check or move king, in place so the caller's list is kept
+                #an en passant capture of the checking pawn doesn't end on its square
+                moves[:] = [move for move in moves if move.pieceMoved[1] == 'K' or move.end in validSquares or
+                            (move.isEnpassantMove and (move.start[0], move.end[1]) in validSquares)]
             else:#double check, ust move king
                 self.get_king_moves(kingRow, kingCol, moves)
         else:#not in check
-            moves = self.get_all_possible_moves()
+            self.get_all_possible_moves(moves)
 
         return moves
 
     '''
     All moves without considering checks
     '''
-    def get_all_possible_moves(self):
-        moves = []
+    def get_all_possible_moves(self, moves=None):
+        if moves is None:
+            moves = []
         for r in range(len(self.board)): #number of rows
             for c in range(len(self.board[r])): #number of collumns in given row
                 turn = self.board[r][c][0] #color of piece ar (r, c)
@@ -116,54 +410,67 @@ class GameState():
     Get all possible moves for a given pawn
     '''
     def get_pawn_moves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        pinDirection = self.pinDirections.get((r, c))
+        piecePinned = pinDirection is not None
+        board = self.board
         #black pawns move down board, white up the board
-        #pawn has two avaiable moves on first move
-        if self.whiteToMove: #white's turn
-            if self.board[r-1][c] == "--": #one square pawn advance
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r-1, c), self.board))
-                    if r == 6 and self.board[r-2][c] == "--": #two square pawn advance
-                        moves.append(Move((r, c), (r-2, c), self.board))
-            if c-1 >= 0 and self.board[r-1][c-1][0] == "b":
-                if not piecePinned or pinDirection == (-1, -1):
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
-            if c+1 <= 7 and self.board[r-1][c+1][0] == "b":
-                if not piecePinned or pinDirection == (-1, 1):
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
-        else:#black pawn moves
-            if self.board[r+1][c] == "--": #one square pawn advance
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r+1, c), self.board))
-                    if r == 1 and self.board[r+2][c] == "--": #two square pawn advance
-                        moves.append(Move((r, c), (r+2, c), self.board))
-            if c-1 >= 0 and self.board[r+1][c-1][0] == "w":
-                if not piecePinned or pinDirection == (1, -1):
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
-            if c+1 <= 7 and self.board[r+1][c+1][0] == "w":
-                if not piecePinned or pinDirection == (1, 1):
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
+        if self.whiteToMove:
+            moveAmount = -1
+            startRow = 6
+            enemyColor = "b"
+        else:
+            moveAmount = 1
+            startRow = 1
+            enemyColor = "w"
+        if board[r+moveAmount][c] == "--": #one square pawn advance
+            if not piecePinned or pinDirection == (moveAmount, 0):
+                self.add_pawn_move((r, c), (r+moveAmount, c), moves)
+                #pawn has two avaiable moves on first move
+                if r == startRow and board[r+2*moveAmount][c] == "--": #two square pawn advance
+                    moves.append(Move((r, c), (r+2*moveAmount, c), board))
+        for dc in (-1, 1): #captures
+            if 0 <= c+dc <= 7 and (not piecePinned or pinDirection == (moveAmount, dc)):
+                endSq = (r+moveAmount, c+dc)
+                if board[endSq[0]][endSq[1]][0] == enemyColor:
+                    self.add_pawn_move((r, c), endSq, moves)
+                elif endSq == self.enpassantPossible and not self.enpassant_reveals_check(r, c, c+dc):
+                    moves.append(Move((r, c), endSq, board, isEnpassantMove=True))
+
+    '''
+    Adds a pawn move, one per promotion piece when the pawn reaches the last rank
+    '''
+    def add_pawn_move(self, startSq, endSq, moves):
+        if endSq[0] == 0 or endSq[0] == 7:
+            for piece in PROMOTION_CHOICES:
+                moves.append(Move(startSq, endSq, self.board, promotionPiece=piece))
+        else:
+            moves.append(Move(startSq, endSq, self.board))
+
+    '''
+    An en passant capture takes two pawns off the same rank at once, which can open that rank to an enemy rook or
+    queen on the king. A pin on a single piece doesn't catch that, so look along the rank
+    '''
+    def enpassant_reveals_check(self, r, c, capturedCol):
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if kingRow != r:
+            return False
+        enemyColor = "b" if self.whiteToMove else "w"
+        step = 1 if c > kingCol else -1
+        col = kingCol + step
+        while 0 <= col < 8:
+            if col != c and col != capturedCol:
+                piece = self.board[r][col]
+                if piece != "--":
+                    return piece[0] == enemyColor and (piece[1] == "R" or piece[1] == "Q")
+            col += step
+        return False
 
     '''
     Get all possible moves for a given rook
     '''
     def get_rook_moves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q':
-                    self.pins.remove(self.pins[i])
-                break
+        pinDirection = self.pinDirections.get((r, c))
+        piecePinned = pinDirection is not None
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
         enemyColor = "b" if self.whiteToMove else "w"
         for d in directions:
@@ -187,15 +494,8 @@ class GameState():
     Get all possible moves for a given bishop
     '''
     def get_bishop_moves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q':
-                    self.pins.remove(self.pins[i])
-                break
+        pinDirection = self.pinDirections.get((r, c))
+        piecePinned = pinDirection is not None
         directions = ((-1, -1), (1, 1), (1, -1), (-1, 1))
         enemyColor = "b" if self.whiteToMove else "w"
         for d in directions:
@@ -219,20 +519,11 @@ class GameState():
     Get all possible moves for a given knight
     '''
     def get_knight_moves(self, r, c, moves):
-        piecePinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                if self.board[r][c][1] != 'Q':
-                    self.pins.remove(self.pins[i])
-                break
-        shifts = [-2, -1, 1, 2]
-        for x in shifts:
-            for y in shifts:
-                if (0 <= r+y < 8 and 0 <= c+x < 8) and not piecePinned:
-                    if (self.board[r+y][c+x] == "--" or self.board[r+y][c+x][0] != self.board[r][c][0]):
-                        moves.append(Move((r, c), (r+y, c+x), self.board))
-        pass
+        piecePinned = (r, c) in self.pinDirections
+        for y, x in self.knightShifts:
+            if (0 <= r+y < 8 and 0 <= c+x < 8) and not piecePinned:
+                if (self.board[r+y][c+x] == "--" or self.board[r+y][c+x][0] != self.board[r][c][0]):
+                    moves.append(Move((r, c), (r+y, c+x), self.board))
 
     '''
     Get all possible moves for a given queen
@@ -246,27 +537,83 @@ class GameState():
     '''
     def get_king_moves(self, r, c, moves):
         allyColor = "w" if self.whiteToMove else "b"
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                if (0 <= r+y < 8 and 0 <= c+x < 8):
-                    endRow = r + y
-                    endCol = c + x
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor:
-                        #place king and check for checks
-                        if allyColor == "w":
-                            self.whiteKingLocation = (endRow, endCol)
-                        else:
-                            self.blackKingLocation = (endRow, endCol)
-                        inCheck, pins, checks = self.check_pins_checks()
-                        if not inCheck:
-                            moves.append(Move((r,c), (endRow, endCol), self.board))
-                        if allyColor == "w":
-                            self.whiteKingLocation = (r, c)
-                        else:
-                            self.blackKingLocation = (r, c)
+        targets = []
+        for y, x in self.kingShifts:
+            if 0 <= r+y < 8 and 0 <= c+x < 8 and self.board[r+y][c+x][0] != allyColor:
+                targets.append((r+y, c+x))
+        if allyColor == "w":
+            rights = self.castlingRights & (CASTLE_WK | CASTLE_WQ) if (r, c) == (7, 4) else 0
+        else:
+            rights = self.castlingRights & (CASTLE_BK | CASTLE_BQ) if (r, c) == (0, 4) else 0
+        if self.inCheck:
+            rights = 0
+        if len(targets) == 0 and rights == 0:
+            return
+        #one attack map for all the king's squares instead of a check test per square
+        attacked = self.get_attacked_squares("b" if allyColor == "w" else "w", (r, c))
+        for endSq in targets:
+            if endSq not in attacked:
+                moves.append(Move((r, c), endSq, self.board))
+        if rights:
+            self.get_castle_moves(r, c, rights, attacked, moves)
+
+    '''
+    Castling, the king can't be in check or pass through or land on an attacked square, and every square between
+    king and rook has to be empty. rights are the side to move's castling rights
+    '''
+    def get_castle_moves(self, r, c, rights, attacked, moves):
+        row = self.board[r]
+        rook = row[c][0] + "R"
+        if rights & (CASTLE_WK | CASTLE_BK) and row[7] == rook and row[c+1] == "--" and row[c+2] == "--" and \
+                (r, c+1) not in attacked and (r, c+2) not in attacked:
+            moves.append(Move((r, c), (r, c+2), self.board, isCastleMove=True))
+        if rights & (CASTLE_WQ | CASTLE_BQ) and row[0] == rook and row[c-1] == "--" and row[c-2] == "--" and \
+                row[c-3] == "--" and (r, c-1) not in attacked and (r, c-2) not in attacked:
+            moves.append(Move((r, c), (r, c-2), self.board, isCastleMove=True))
 
-                        moves.append(Move((r, c), (r+y, c+x), self.board))
+    '''
+    Set of squares attacked by the given color. The square in ignoreSq is treated as empty, pass the moving king's
+    square so sliders attack through it
+    '''
+    def get_attacked_squares(self, color, ignoreSq=None):
+        attacked = set()
+        board = self.board
+        pawnStep = 1 if color == "b" else -1
+        for r in range(8):
+            row = board[r]
+            for c in range(8):
+                piece = row[c]
+                if piece[0] != color:
+                    continue
+                pieceType = piece[1]
+                if pieceType == "P":
+                    if 0 <= r + pawnStep < 8:
+                        if c > 0:
+                            attacked.add((r + pawnStep, c - 1))
+                        if c < 7:
+                            attacked.add((r + pawnStep, c + 1))
+                elif pieceType == "N" or pieceType == "K":
+                    shifts = self.knightShifts if pieceType == "N" else self.kingShifts
+                    for y, x in shifts:
+                        if 0 <= r+y < 8 and 0 <= c+x < 8:
+                            attacked.add((r+y, c+x))
+                else:
+                    if pieceType == "R":
+                        directions = self.directions[:4]
+                    elif pieceType == "B":
+                        directions = self.directions[4:]
+                    else:
+                        directions = self.directions
+                    for dr, dc in directions:
+                        endRow = r + dr
+                        endCol = c + dc
+                        while 0 <= endRow < 8 and 0 <= endCol < 8:
+                            attacked.add((endRow, endCol))
+                            if board[endRow][endCol] != "--" and (endRow, endCol) != ignoreSq:
+                                break
+                            endRow += dr
+                            endCol += dc
+        return attacked
 
     def check_pins_checks(self):
         pins = []
@@ -282,7 +629,7 @@ class GameState():
             allyColor = "b"
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
-        directions = ((-1, 0), (0, 1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        directions = self.directions
         for j in range(len(directions)):
             d = directions[j]
             possiblePin = ()
@@ -308,10 +655,12 @@ class GameState():
                                 break
                             else: #piece blocking so pin
                                 pins.append(possiblePin)
+                                break
+                        else: #enemy piece that can't attack along this line
+                            break
                 else:
                         break #offboard
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
+        for m in self.knightShifts:
             endRow = startRow + m[0]
             endCol = startCol + m[1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
@@ -322,7 +671,52 @@ class GameState():
         return inCheck, pins, checks
 
 
+class MoveCache():
+    '''
+    Least recently used cache of (inCheck, moves) by position hash, holds at most size positions. Moves are
+    shared between the lists handed out, which is fine since nothing changes a Move after it is generated
+    '''
+    def __init__(self, size=4096):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "maxSize": self.size, "hits": self.hits, "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+#promotion piece <-> code used in packed moves
+PROMOTION_CODES = {None: 0, "N": 1, "B": 2, "R": 3, "Q": 4}
+PROMOTION_PIECES = {v: k for k, v in PROMOTION_CODES.items()}
+
+
 class Move():
+    #moves are created by the dozen for every position, slots keep each one small and skip the per object dict
+    __slots__ = ("start", "end", "pieceMoved", "pieceCaptured", "moveID", "isPawnPromotion", "promotionPiece",
+                 "isEnpassantMove", "isCastleMove")
     # map keys to values
     # key : value
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -332,16 +726,22 @@ class Move():
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v:k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False):
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False, promotionPiece=None):
         self.start = startSq
         self.end = endSq
-        self.pieceMoved = board[self.start[0]][self.start[1]]
-        self.pieceCaptured = board[self.end[0]][self.end[1]]
-        self.moveID = 1000*self.start[0] + 100*self.start[1] + 10*self.end[0] + self.end[1]
-        #pawn promotion
-        self.isPawnPromotion = ((self.pieceMoved == "wP" and self.end[0] == 0) or (self.pieceMoved == "bP" and self.end[0] == 7))
-        #en passant
+        self.pieceMoved = pieceMoved = board[startSq[0]][startSq[1]]
+        self.pieceCaptured = board[endSq[0]][endSq[1]]
+        #pawn promotion, to a queen unless another piece is given
+        self.isPawnPromotion = pieceMoved[1] == "P" and (endSq[0] == 0 or endSq[0] == 7)
+        self.promotionPiece = (promotionPiece or "Q") if self.isPawnPromotion else None
+        #en passant, the captured pawn isn't on the end square
         self.isEnpassantMove = isEnpassantMove
+        if isEnpassantMove:
+            self.pieceCaptured = "bP" if pieceMoved == "wP" else "wP"
+        self.isCastleMove = isCastleMove
+        #promotions to different pieces are different moves
+        self.moveID = 10000*PROMOTION_CODES[self.promotionPiece] + 1000*startSq[0] + 100*startSq[1] + \
+                      10*endSq[0] + endSq[1]
 
     '''
     Overriding the equals method
@@ -350,6 +750,29 @@ class Move():
         if isinstance(other, Move):
             return self.moveID == other.moveID
 
+    def __hash__(self):
+        return self.moveID
+
+    '''
+    The move as a single int: bits 0-5 start square, 6-11 end square, 12-14 promotion piece, 15 en passant.
+    Squares are numbered row * 8 + col
+    '''
+    def pack(self):
+        return (self.start[0] * 8 + self.start[1]) | (self.end[0] * 8 + self.end[1]) << 6 | \
+               PROMOTION_CODES[self.promotionPiece] << 12 | self.isEnpassantMove << 15
+
+    '''
+    Rebuilds a move from pack(), board must be the position the move is played from
+    '''
+    @staticmethod
+    def unpack(packed, board):
+        startSq = packed & 63
+        endSq = (packed >> 6) & 63
+        #a king moving two squares can only be castling
+        isCastleMove = board[startSq // 8][startSq % 8][1] == "K" and abs(endSq - startSq) == 2
+        return Move((startSq // 8, startSq % 8), (endSq // 8, endSq % 8), board, bool(packed >> 15 & 1),
+                    isCastleMove, PROMOTION_PIECES[(packed >> 12) & 7])
+
     def get_chess_notation(self): #modify to include full chess notation
         return self.get_rank_file(self.start[0], self.start[1]) + self.get_rank_file(self.end[0], self.end[1])
 
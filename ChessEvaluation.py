@@ -0,0 +1,135 @@
+"""
+Material and piece-square tables for the evaluation. GameState keeps the midgame and endgame sums of these tables as
+running totals in make_move/undo_move, so evaluate() only has to blend two numbers instead of scanning the board.
+Tables are from Tomasz Michniewski's "Simplified Evaluation Function", with an endgame king table that pulls the king
+to the center and an endgame pawn table that rewards advanced pawns.
+"""
+
+MG_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+EG_VALUES = {"P": 120, "N": 300, "B": 320, "R": 520, "Q": 920, "K": 0}
+#game phase, 24 with all pieces on the board, 0 with only kings and pawns
+PHASE_WEIGHTS = {"P": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MAX_PHASE = 24
+
+#from white's point of view, row 0 is the 8th rank like GameState.board
+PAWN_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0]
+PAWN_END_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0]
+QUEEN_TABLE = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+KING_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+KING_END_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+MG_TABLES = {"P": PAWN_TABLE, "N": KNIGHT_TABLE, "B": BISHOP_TABLE, "R": ROOK_TABLE, "Q": QUEEN_TABLE,
+             "K": KING_TABLE}
+EG_TABLES = {"P": PAWN_END_TABLE, "N": KNIGHT_TABLE, "B": BISHOP_TABLE, "R": ROOK_TABLE, "Q": QUEEN_TABLE,
+             "K": KING_END_TABLE}
+
+
+def _build_scores(values, tables):
+    scores = {}
+    for pieceType, table in tables.items():
+        #square index is row * 8 + col, black reads the table upside down and counts against white
+        scores["w" + pieceType] = [values[pieceType] + table[sq] for sq in range(64)]
+        scores["b" + pieceType] = [-(values[pieceType] + table[(7 - sq // 8) * 8 + sq % 8]) for sq in range(64)]
+    scores["--"] = [0] * 64
+    return scores
+
+
+#piece -> 64 signed scores (material + square bonus), positive is good for white
+MG_SCORES = _build_scores(MG_VALUES, MG_TABLES)
+EG_SCORES = _build_scores(EG_VALUES, EG_TABLES)
+PHASE = {color + pieceType: weight for color in "wb" for pieceType, weight in PHASE_WEIGHTS.items()}
+PHASE["--"] = 0
+
+
+'''
+Midgame score, endgame score and phase of a board, computed from scratch
+'''
+def score_board(board):
+    mg = 0
+    eg = 0
+    phase = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != "--":
+                mg += MG_SCORES[piece][r * 8 + c]
+                eg += EG_SCORES[piece][r * 8 + c]
+                phase += PHASE[piece]
+    return mg, eg, phase
+
+
+'''
+Evaluation in centipawns from the side to move's point of view, blends the running midgame and endgame totals
+kept on gs by how much material is left
+'''
+def evaluate(gs):
+    phase = min(gs.phase, MAX_PHASE)
+    score = (gs.mgScore * phase + gs.egScore * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if gs.whiteToMove else -score
@@ -5,12 +5,17 @@ and displaying the current GameState object
 
 import pygame as p
 import ChessEngine
+import ChessWorker
 
 WIDTH = HEIGHT = 512 #400 is another option
 DIMENSION = 8 #chess boards are 8x8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15 #for animation later on
 IMAGES = {}
+WHITE_HUMAN = True #set to False to have the engine play white
+BLACK_HUMAN = True #set to False to have the engine play black
+ENGINE_TIME = 2.0 #seconds the engine thinks per move
+BOOK_PATH = None #opening book built with ChessBook.py, the engine plays from it while the position is in it
+POLL_MS = 50 #how often to check for the engine's move while it thinks
 
 '''
 Initialize a global dictionary of images. This will be called exactly once in main
@@ -25,25 +30,58 @@ def load_images():
 The main driver for our code. This will handle user input and updating the graphics
 '''
 def main():
+    #start the engine process before pygame so it doesn't inherit the display
+    engine = ChessWorker.EngineWorker(BOOK_PATH) if not (WHITE_HUMAN and BLACK_HUMAN) else None
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
-    clock = p.time.Clock()
     gs = ChessEngine.GameState()
+    gs.enable_move_cache() #undoing back to a position reuses its moves
     validMoves = gs.get_valid_moves()
     moveMade = False#flag variable for when a move is made
     load_images() #only do this once, before the while loop, reduced time complexity
+    boardSurface = make_board_surface() #the empty board never changes, draw it once and copy from it
+    drawnBoard = None #copy of the board as it is on screen, None forces a full redraw
+    drawnSelection = ()
     running = True
     sqSelected = () #no square selected initially, keep track of last click (tuple: row, collumn)
     playerClicks = [] #up to two player clicks tracked
     while running:
-        for e in p.event.get():
+        if drawnBoard is None:
+            draw_game_state(screen, gs, boardSurface, sqSelected)
+            p.display.flip()
+        else:
+            dirtySquares = get_dirty_squares(drawnBoard, gs.board)
+            if sqSelected != drawnSelection:
+                dirtySquares.update(sq for sq in (drawnSelection, sqSelected) if sq != ())
+            if dirtySquares:
+                p.display.update(draw_squares(screen, boardSurface, gs.board, dirtySquares, sqSelected))
+        drawnBoard = [row[:] for row in gs.board]
+        drawnSelection = sqSelected
+        if not is_human_turn(gs) and not engine.is_thinking() and len(validMoves) > 0:
+            engine.submit(gs, timeLimit=ENGINE_TIME) #the engine thinks in its own process, the window stays live
+        #nothing changes on screen without an event, so sleep until one arrives instead of redrawing every frame
+        if engine is not None and engine.is_thinking():
+            firstEvent = p.event.wait(POLL_MS) #wake up regularly to check on the engine
+        else:
+            firstEvent = p.event.wait()
+        for e in [firstEvent] + p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.WINDOWEXPOSED or e.type == p.VIDEOEXPOSE:
+                drawnBoard = None
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_BACKSPACE:
+                    if engine is not None:
+                        engine.cancel()
                     gs.undo_move()
+                    #against the engine, take back its move too so it's the human's turn again
+                    while engine is not None and (WHITE_HUMAN or BLACK_HUMAN) and len(gs.moveLog) > 0 and \
+                            not is_human_turn(gs):
+                        gs.undo_move()
+                    sqSelected = ()
+                    playerClicks = []
                     moveMade = True
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.MOUSEBUTTONDOWN and is_human_turn(gs):
                 location = p.mouse.get_pos() #(x, y) location of mouse
                 col = location[0] // SQ_SIZE
                 row = location[1] // SQ_SIZE
@@ -64,22 +102,69 @@ def main():
                             playerClicks = []
                     if not moveMade:
                         playerClicks = [sqSelected]
+        if engine is not None:
+            for message in engine.poll():
+                if message[0] == "bestmove" and message[2] is not None:
+                    move = ChessEngine.Move.unpack(message[2], gs.board)
+                    for validMove in validMoves:
+                        if move == validMove:
+                            gs.make_move(validMove)
+                            moveMade = True
+                            break
         if moveMade:
             validMoves = gs.get_valid_moves()
             moveMade = False
-
-        draw_game_state(screen, gs)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+    if engine is not None:
+        engine.close()
     print(gs.board)
 
+def is_human_turn(gs):
+    return (gs.whiteToMove and WHITE_HUMAN) or (not gs.whiteToMove and BLACK_HUMAN)
+
+'''
+Squares whose piece differs between what is on screen and the current board, covers moves, undos, captures and
+anything that moves more than one piece
+'''
+def get_dirty_squares(drawnBoard, board):
+    dirty = set()
+    for r in range(DIMENSION):
+        if drawnBoard[r] != board[r]:
+            for c in range(DIMENSION):
+                if drawnBoard[r][c] != board[r][c]:
+                    dirty.add((r, c))
+    return dirty
+
+'''
+Redraws only the given squares, returns their rectangles for display.update
+'''
+def draw_squares(screen, boardSurface, board, squares, sqSelected):
+    rects = []
+    for r, c in squares:
+        rect = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(boardSurface, rect, rect) #copy the empty square from the cached board
+        piece = board[r][c]
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        if (r, c) == sqSelected:
+            draw_selection(screen, sqSelected)
+        rects.append(rect)
+    return rects
+
+'''
+Outline the selected square
+'''
+def draw_selection(screen, sqSelected):
+    if sqSelected != ():
+        r, c = sqSelected
+        p.draw.rect(screen, p.Color("blue"), p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE), 3)
+
 '''
 Draws the squares and pieces on the boards. Responsible for all graphics.
 '''
-def draw_game_state(screen, gs):
-    draw_board(screen) #draw squares on board
-    #add in pieces highlighting or move suggestions (later)
+def draw_game_state(screen, gs, boardSurface, sqSelected):
+    screen.blit(boardSurface, (0, 0)) #draw squares on board
     draw_pieces(screen, gs.board) #draw pieces on top of these squares
+    draw_selection(screen, sqSelected)
 
 '''
 Draw the squares on the boards. The top left square is always white
@@ -101,5 +186,13 @@ def draw_pieces(screen, board):
             if piece != "--": #not an empty square
                 screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
+'''
+The empty board on its own surface, built once so squares can be restored by copying from it
+'''
+def make_board_surface():
+    surface = p.Surface((WIDTH, HEIGHT))
+    draw_board(surface)
+    return surface
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,335 @@
+"""
+NumPy batch mode for labelling large sets of positions. N positions are held as an (N, 8, 8) int8 array and attack maps,
+legal move counts and static evaluations are computed for all of them at once with array operations instead of a
+Python loop per position. Needs numpy (pip install numpy), the rest of the engine does not.
+
+Piece codes: 0 empty, 1-6 white pawn, knight, bishop, rook, queen, king, negative for black.
+
+    python ChessNumpy.py positions.txt --batch-size 100000
+
+prints one JSON line per FEN with its legal move count and evaluation.
+"""
+import argparse
+import json
+import sys
+
+try:
+    import numpy as np
+except ImportError: #numpy is only needed for this module
+    np = None
+
+import ChessBatch
+import ChessBitboard
+import ChessEngine
+import ChessEvaluation
+
+PIECE_CODES = {"--": 0, "wP": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+               "bP": -1, "bN": -2, "bB": -3, "bR": -4, "bQ": -5, "bK": -6}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_SHIFTS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_SHIFTS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+PROMOTION_MOVES = len(ChessEngine.PROMOTION_CHOICES) #moves generated per promotion square
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("ChessNumpy needs numpy, install it with 'pip install numpy'")
+
+
+'''
+Moves every entry of a (N, 8, 8) array by (dr, dc), squares shifted in from off the board are 0/False
+'''
+def shift(a, dr, dc):
+    out = np.zeros_like(a)
+    out[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        a[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return out
+
+
+def _table_array(scores):
+    #(13, 8, 8) lookup indexed by piece code + 6
+    table = np.zeros((13, 8, 8), dtype=np.int32)
+    for piece, code in PIECE_CODES.items():
+        table[code + 6] = np.array(scores[piece], dtype=np.int32).reshape(8, 8)
+    return table
+
+
+class PositionBatch():
+    def __init__(self, boards, whiteToMove, castling=None, enpassant=None, fens=None):
+        require_numpy()
+        self.boards = np.asarray(boards, dtype=np.int8) #(N, 8, 8)
+        n = len(self.boards)
+        self.whiteToMove = np.asarray(whiteToMove, dtype=bool) #(N,)
+        #(N, 4) castling rights in ChessEngine.CASTLE_FLAGS order, none if not given
+        self.castling = np.zeros((n, 4), dtype=bool) if castling is None else np.asarray(castling, dtype=bool)
+        #(N,) en passant square as row * 8 + col, -1 for none
+        self.enpassant = np.full(n, -1, dtype=np.int8) if enpassant is None else np.asarray(enpassant, dtype=np.int8)
+        self.fens = fens #used to hand unusual positions to the regular move generator
+
+    @staticmethod
+    def from_states(states):
+        require_numpy()
+        boards = np.array([[[PIECE_CODES[piece] for piece in row] for row in gs.board] for gs in states], dtype=np.int8)
+        castling = [[gs.castlingRights >> i & 1 for i in range(4)] for gs in states]
+        enpassant = [gs.enpassantPossible[0] * 8 + gs.enpassantPossible[1] if gs.enpassantPossible != () else -1
+                     for gs in states]
+        return PositionBatch(boards.reshape(-1, 8, 8), [gs.whiteToMove for gs in states],
+                             np.array(castling, dtype=bool).reshape(-1, 4), enpassant, [gs.get_fen() for gs in states])
+
+    @staticmethod
+    def from_fens(fens):
+        require_numpy()
+        fens = list(fens)
+        boards = np.zeros((len(fens), 8, 8), dtype=np.int8)
+        castling = np.zeros((len(fens), 4), dtype=bool)
+        enpassant = np.full(len(fens), -1, dtype=np.int8)
+        for i, fen in enumerate(fens):
+            fields = fen.split()
+            if len(fields) > 2:
+                castling[i] = [flag in fields[2] for flag in ChessEngine.CASTLE_FLAGS]
+            if len(fields) > 3 and fields[3] != "-":
+                enpassant[i] = ChessEngine.Move.ranksToRows[fields[3][1]] * 8 + \
+                               ChessEngine.Move.filesToCols[fields[3][0]]
+            for r, rank in enumerate(fields[0].split("/")):
+                c = 0
+                for ch in rank:
+                    if ch.isdigit():
+                        c += int(ch)
+                    else:
+                        boards[i, r, c] = PIECE_CODES[("w" if ch.isupper() else "b") + ch.upper()]
+                        c += 1
+        return PositionBatch(boards, [fen.split()[1] == "w" for fen in fens], castling, enpassant, fens)
+
+    def __len__(self):
+        return len(self.boards)
+
+    '''
+    FEN of position i, the move counters are only known when the batch was built from FENs
+    '''
+    def get_fen(self, i):
+        if self.fens is not None:
+            return self.fens[i]
+        rows = []
+        for r in range(8):
+            rank = ""
+            empty = 0
+            for c in range(8):
+                piece = CODE_PIECES[int(self.boards[i, r, c])]
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            rows.append(rank + (str(empty) if empty else ""))
+        castling = "".join(flag for flag, right in zip(ChessEngine.CASTLE_FLAGS, self.castling[i]) if right) or "-"
+        sq = int(self.enpassant[i])
+        enpassant = ChessEngine.Move.colsToFiles[sq % 8] + ChessEngine.Move.rowsToRanks[sq // 8] if sq >= 0 else "-"
+        return " ".join(["/".join(rows), "w" if self.whiteToMove[i] else "b", castling, enpassant, "0", "1"])
+
+    '''
+    Boards signed so the side to move's pieces are positive
+    '''
+    def relative_boards(self):
+        sign = np.where(self.whiteToMove, 1, -1).astype(np.int8)
+        return self.boards * sign[:, None, None]
+
+    '''
+    (N, 8, 8) bool, squares attacked by the side with positive codes in rel. Sliders stop at the first piece
+    '''
+    @staticmethod
+    def attacks_of(rel, forward):
+        empty = rel == 0
+        attacks = np.zeros(rel.shape, dtype=bool)
+        pawns = rel == PAWN
+        attacks |= shift(pawns, forward, -1) | shift(pawns, forward, 1)
+        knights = rel == KNIGHT
+        for dr, dc in KNIGHT_SHIFTS:
+            attacks |= shift(knights, dr, dc)
+        kings = rel == KING
+        for dr, dc in KING_SHIFTS:
+            attacks |= shift(kings, dr, dc)
+        for directions, pieceType in ((ROOK_DIRECTIONS, ROOK), (BISHOP_DIRECTIONS, BISHOP)):
+            frontier = (rel == pieceType) | (rel == QUEEN)
+            for dr, dc in directions:
+                ray = frontier
+                for _ in range(7):
+                    ray = shift(ray, dr, dc)
+                    attacks |= ray
+                    ray = ray & empty
+                    if not ray.any():
+                        break
+        return attacks
+
+    '''
+    (N, 8, 8) bool attack maps for the side to move (ours=True) or for its opponent
+    '''
+    def attack_maps(self, ours=True):
+        rel = self.relative_boards()
+        result = np.zeros(rel.shape, dtype=bool)
+        for white in (True, False):
+            mask = self.whiteToMove == white
+            if not mask.any():
+                continue
+            side = rel[mask] if ours else -rel[mask]
+            #white pawns attack up the board (row - 1), black pawns down
+            pawnForward = -1 if white == ours else 1
+            result[mask] = self.attacks_of(side, pawnForward)
+        return result
+
+    '''
+    Boolean (N,) - positions where the side to move is in check, has a pinned piece or may capture en passant.
+    Those go through the regular move generator in legal_move_counts
+    '''
+    def needs_full_check(self, enemyAttacks=None):
+        rel = self.relative_boards()
+        if enemyAttacks is None:
+            enemyAttacks = self.attack_maps(ours=False)
+        n = len(rel)
+        kingFlat = (rel == KING).reshape(n, 64).argmax(axis=1)
+        kingRow = kingFlat // 8
+        kingCol = kingFlat % 8
+        index = np.arange(n)
+        inCheck = enemyAttacks[index, kingRow, kingCol]
+        pinned = np.zeros(n, dtype=bool)
+        for directions, pieceType in ((ROOK_DIRECTIONS, ROOK), (BISHOP_DIRECTIONS, BISHOP)):
+            for dr, dc in directions:
+                ownSeen = np.zeros(n, dtype=bool)
+                done = np.zeros(n, dtype=bool)
+                for k in range(1, 8):
+                    r = kingRow + dr * k
+                    c = kingCol + dc * k
+                    onBoard = (r >= 0) & (r < 8) & (c >= 0) & (c < 8)
+                    done |= ~onBoard
+                    piece = np.where(onBoard, rel[index, np.clip(r, 0, 7), np.clip(c, 0, 7)], 0)
+                    active = ~done & (piece != 0)
+                    enemySlider = (piece == -pieceType) | (piece == -QUEEN)
+                    pinned |= active & ownSeen & enemySlider
+                    done |= active & (ownSeen | (piece < 0))
+                    ownSeen |= active & (piece > 0)
+                    if done.all():
+                        break
+        return inCheck | pinned | (self.enpassant >= 0)
+
+    '''
+    (N,) number of legal moves for the side to move. Positions needs_full_check picks out are counted by the
+    bitboard move generator, the rest entirely with array operations
+    '''
+    def legal_move_counts(self):
+        rel = self.relative_boards()
+        n = len(rel)
+        own = rel > 0
+        enemy = rel < 0
+        empty = rel == 0
+        notOwn = ~own
+        enemyAttacks = self.attack_maps(ours=False)
+        counts = np.zeros(n, dtype=np.int64)
+        #knights and king
+        knights = rel == KNIGHT
+        for dr, dc in KNIGHT_SHIFTS:
+            counts += (shift(knights, dr, dc) & notOwn).sum(axis=(1, 2))
+        kings = rel == KING
+        for dr, dc in KING_SHIFTS:
+            counts += (shift(kings, dr, dc) & notOwn & ~enemyAttacks).sum(axis=(1, 2))
+        #sliders, rays in one direction from different pieces never overlap so the sums count every move once
+        for directions, pieceType in ((ROOK_DIRECTIONS, ROOK), (BISHOP_DIRECTIONS, BISHOP)):
+            frontier = (rel == pieceType) | (rel == QUEEN)
+            for dr, dc in directions:
+                ray = frontier
+                for _ in range(7):
+                    ray = shift(ray, dr, dc)
+                    counts += (ray & notOwn).sum(axis=(1, 2))
+                    ray = ray & empty
+                    if not ray.any():
+                        break
+        #pawns, flip black positions vertically so every pawn moves up the board
+        flip = ~self.whiteToMove
+        pawns = rel == PAWN
+        pawns[flip] = pawns[flip, ::-1]
+        emptyUp = empty.copy()
+        emptyUp[flip] = emptyUp[flip, ::-1]
+        enemyUp = enemy.copy()
+        enemyUp[flip] = enemyUp[flip, ::-1]
+        single = shift(pawns, -1, 0) & emptyUp
+        double = shift(single & (np.arange(8) == 5)[None, :, None], -1, 0) & emptyUp
+        captures = (shift(pawns, -1, -1) & enemyUp).astype(np.int64) + (shift(pawns, -1, 1) & enemyUp)
+        pawnTargets = single.astype(np.int64) + captures
+        counts += double.sum(axis=(1, 2))
+        counts += pawnTargets[:, 1:].sum(axis=(1, 2)) + pawnTargets[:, 0].sum(axis=1) * PROMOTION_MOVES
+        #castling, a position in check is counted by the move generator anyway
+        index = np.arange(n)
+        homeRow = np.where(self.whiteToMove, 7, 0)
+        home = rel[index, homeRow] #(N, 8)
+        homeAttacked = enemyAttacks[index, homeRow]
+        kingHome = home[:, 4] == KING
+        kingSide = self.castling[index, np.where(self.whiteToMove, 0, 2)]
+        queenSide = self.castling[index, np.where(self.whiteToMove, 1, 3)]
+        counts += kingSide & kingHome & (home[:, 7] == ROOK) & (home[:, 5:7] == 0).all(axis=1) & \
+                  ~homeAttacked[:, 5:7].any(axis=1)
+        counts += queenSide & kingHome & (home[:, 0] == ROOK) & (home[:, 1:4] == 0).all(axis=1) & \
+                  ~homeAttacked[:, 2:4].any(axis=1)
+        #everything the vectorized count can't handle goes through the regular generator
+        gs = ChessBitboard.BitboardGameState()
+        for i in np.nonzero(self.needs_full_check(enemyAttacks))[0]:
+            gs.load_fen(self.get_fen(i))
+            counts[i] = len(gs.get_valid_moves())
+        return counts
+
+    '''
+    (N,) static evaluations in centipawns from the side to move's point of view, same as ChessEvaluation.evaluate
+    '''
+    def evaluate(self):
+        codes = self.boards.astype(np.intp) + 6
+        squares = np.arange(64)
+        mg = MG_TABLE.reshape(13, 64)[codes.reshape(-1, 64), squares].sum(axis=1)
+        eg = EG_TABLE.reshape(13, 64)[codes.reshape(-1, 64), squares].sum(axis=1)
+        phase = np.minimum(PHASE_TABLE[codes].sum(axis=(1, 2)), ChessEvaluation.MAX_PHASE)
+        score = (mg * phase + eg * (ChessEvaluation.MAX_PHASE - phase)) // ChessEvaluation.MAX_PHASE
+        return np.where(self.whiteToMove, score, -score)
+
+
+if np is not None:
+    MG_TABLE = _table_array(ChessEvaluation.MG_SCORES)
+    EG_TABLE = _table_array(ChessEvaluation.EG_SCORES)
+    PHASE_TABLE = np.zeros(13, dtype=np.int32)
+    for _piece, _code in PIECE_CODES.items():
+        PHASE_TABLE[_code + 6] = ChessEvaluation.PHASE[_piece]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Label positions with legal move counts and evaluations")
+    parser.add_argument("file", help="file with one FEN per line, - for stdin")
+    parser.add_argument("--batch-size", type=int, default=100000, help="positions per array batch")
+    args = parser.parse_args(argv)
+
+    f = sys.stdin if args.file == "-" else open(args.file)
+    try:
+        index = 0
+        fens = []
+        for fen in ChessBatch.read_fens(f):
+            fens.append(fen)
+            if len(fens) == args.batch_size:
+                index = print_batch(fens, index)
+                fens = []
+        if fens:
+            print_batch(fens, index)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return 0
+
+
+def print_batch(fens, index):
+    batch = PositionBatch.from_fens(fens)
+    for fen, moves, score in zip(fens, batch.legal_move_counts().tolist(), batch.evaluate().tolist()):
+        print(json.dumps({"index": index, "fen": fen, "moves": moves, "score": score}))
+        index += 1
+    return index
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Standard algebraic notation (SAN) and PGN support. read_games() reads a PGN file one game at a time, so archives of
+any size can be replayed through GameState.make_move without loading the whole file into memory.
+"""
+import re
+
+import ChessEngine
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$")
+TAG_PATTERN = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]\s*$')
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+#order the seven required tags are written in
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+
+'''
+SAN for a move that is legal in gs, e.g. "Nbd2", "exd6", "e8=Q+", "O-O". validMoves can be passed in if the
+caller already has them
+'''
+def get_san(gs, move, validMoves=None):
+    if validMoves is None:
+        validMoves = gs.get_valid_moves()
+    pieceType = move.pieceMoved[1]
+    if pieceType == "K" and abs(move.end[1] - move.start[1]) == 2:
+        san = "O-O" if move.end[1] > move.start[1] else "O-O-O"
+    else:
+        isCapture = move.pieceCaptured != "--" or move.isEnpassantMove
+        destination = move.get_rank_file(move.end[0], move.end[1])
+        if pieceType == "P":
+            san = (move.colsToFiles[move.start[1]] + "x" if isCapture else "") + destination
+            if move.isPawnPromotion:
+                san += "=" + move.promotionPiece
+        else:
+            #other pieces of the same type that can reach the same square
+            others = [m for m in validMoves if m.pieceMoved == move.pieceMoved and m.end == move.end and
+                      m.start != move.start]
+            disambiguation = ""
+            if others:
+                if all(m.start[1] != move.start[1] for m in others):
+                    disambiguation = move.colsToFiles[move.start[1]]
+                elif all(m.start[0] != move.start[0] for m in others):
+                    disambiguation = move.rowsToRanks[move.start[0]]
+                else:
+                    disambiguation = move.get_rank_file(move.start[0], move.start[1])
+            san = pieceType + disambiguation + ("x" if isCapture else "") + destination
+    gs.make_move(move)
+    replies = gs.get_valid_moves()
+    if gs.inCheck:
+        san += "#" if len(replies) == 0 else "+"
+    gs.undo_move()
+    return san
+
+
+'''
+Finds the legal move in gs that a SAN string describes, raises ValueError if there is none or more than one
+'''
+def parse_san(gs, san, validMoves=None):
+    if validMoves is None:
+        validMoves = gs.get_valid_moves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingSide = len(text) == 3
+        matches = [m for m in validMoves if m.pieceMoved[1] == "K" and
+                   m.end[1] - m.start[1] == (2 if kingSide else -2)]
+    else:
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError("invalid SAN: " + san)
+        pieceType, fromFile, fromRank, capture, destination, promotion = match.groups()
+        pieceType = pieceType or "P"
+        end = (ChessEngine.Move.ranksToRows[destination[1]], ChessEngine.Move.filesToCols[destination[0]])
+        matches = []
+        for m in validMoves:
+            if m.pieceMoved[1] != pieceType or m.end != end:
+                continue
+            if fromFile is not None and m.start[1] != ChessEngine.Move.filesToCols[fromFile]:
+                continue
+            if fromRank is not None and m.start[0] != ChessEngine.Move.ranksToRows[fromRank]:
+                continue
+            if m.isPawnPromotion and m.promotionPiece != (promotion or "Q"):
+                continue
+            matches.append(m)
+    if len(matches) != 1:
+        raise ValueError(("illegal" if len(matches) == 0 else "ambiguous") + " move: " + san)
+    return matches[0]
+
+
+class PGNGame():
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {} #tag name -> value, in file order
+        self.moves = moves if moves is not None else [] #SAN strings
+        self.result = result
+
+    '''
+    A GameState set up at the game's starting position, honoring a FEN tag
+    '''
+    def get_start_state(self, gameStateClass=ChessEngine.GameState):
+        gs = gameStateClass()
+        if "FEN" in self.headers:
+            gs.load_fen(self.headers["FEN"])
+        return gs
+
+    '''
+    Plays the game through gs (or a new GameState at the start position), yielding each move after it is made
+    '''
+    def replay(self, gs=None):
+        if gs is None:
+            gs = self.get_start_state()
+        moves = []
+        for san in self.moves:
+            move = parse_san(gs, san, gs.get_valid_moves(moves))
+            gs.make_move(move)
+            yield move
+
+
+'''
+Reads games one at a time from a text file object (or any iterable of lines). Comments, variations, NAGs and
+annotation glyphs are skipped
+'''
+def read_games(f):
+    game = None
+    inMoves = False
+    commentDepth = 0 #inside {...}
+    variationDepth = 0 #inside (...)
+    for line in f:
+        if commentDepth == 0 and variationDepth == 0:
+            stripped = line.strip()
+            if stripped.startswith("%"): #escape line
+                continue
+            if stripped.startswith("["):
+                if inMoves: #tags after movetext start a new game
+                    yield game
+                    game = None
+                    inMoves = False
+                tag = TAG_PATTERN.match(stripped)
+                if tag is not None:
+                    if game is None:
+                        game = PGNGame()
+                    game.headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        tokens, commentDepth, variationDepth = tokenize_movetext(line, commentDepth, variationDepth)
+        for token in tokens:
+            if game is None:
+                game = PGNGame()
+            inMoves = True
+            if token in RESULTS:
+                game.result = token
+                yield game
+                game = None
+                inMoves = False
+            else:
+                game.moves.append(token)
+    if game is not None and (game.moves or game.headers):
+        yield game
+
+
+'''
+Splits one line of movetext into SAN tokens, carrying open comment/variation depth over to the next line
+'''
+def tokenize_movetext(line, commentDepth, variationDepth):
+    tokens = []
+    i = 0
+    n = len(line)
+    while i < n:
+        ch = line[i]
+        if commentDepth:
+            if ch == "}":
+                commentDepth = 0
+            i += 1
+        elif ch == "{":
+            commentDepth = 1
+            i += 1
+        elif ch == ";": #comment to end of line
+            break
+        elif ch == "(":
+            variationDepth += 1
+            i += 1
+        elif ch == ")":
+            variationDepth = max(0, variationDepth - 1)
+            i += 1
+        elif ch.isspace():
+            i += 1
+        else:
+            j = i
+            while j < n and not line[j].isspace() and line[j] not in "{}();":
+                j += 1
+            token = line[i:j]
+            i = j
+            if variationDepth:
+                continue
+            token = MOVE_NUMBER_PATTERN.sub("", token) #"12." or "12..." glued to the move
+            token = token.rstrip("!?")
+            if token and not token.startswith("$"):
+                tokens.append(token)
+    return tokens, commentDepth, variationDepth
+
+
+'''
+Records the moves played in gs as a PGNGame with SAN moves, gs is left as it was
+'''
+def game_from_state(gs, headers=None, result="*"):
+    played = list(gs.moveLog)
+    for _ in played:
+        gs.undo_move()
+    game = PGNGame(dict(headers or {}), [], result)
+    if gs.get_fen() != ChessEngine.GameState().get_fen():
+        game.headers["SetUp"] = "1"
+        game.headers["FEN"] = gs.get_fen()
+    for move in played:
+        game.moves.append(get_san(gs, move))
+        gs.make_move(move)
+    return game
+
+
+'''
+Writes one game as PGN text to a file object, movetext is wrapped at 80 columns
+'''
+def write_game(f, game):
+    headers = dict(game.headers)
+    headers["Result"] = game.result
+    for name in SEVEN_TAG_ROSTER:
+        f.write('[%s "%s"]\n' % (name, escape_tag(headers.pop(name, "?"))))
+    for name, value in headers.items():
+        f.write('[%s "%s"]\n' % (name, escape_tag(value)))
+    f.write("\n")
+    tokens = []
+    gs = game.get_start_state()
+    moveNumber = gs.get_fullmove_number()
+    whiteToMove = gs.whiteToMove
+    for i, san in enumerate(game.moves):
+        if whiteToMove:
+            tokens.append(str(moveNumber) + ".")
+        elif i == 0:
+            tokens.append(str(moveNumber) + "...")
+        tokens.append(san)
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(game.result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            f.write(line + "\n")
+            line = token
+        else:
+            line = line + " " + token if line else token
+    f.write(line + "\n\n")
+
+
+def escape_tag(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
@@ -0,0 +1,142 @@
+"""
+Perft (performance test) for move generation. Counts every leaf node of the move tree to a given depth and compares
+the count with published values for a set of reference positions. Run it from the command line:
+
+    python ChessPerft.py --depth 3 --backend bitboard --json
+
+--moves counts through get_valid_moves/make_move on every backend, to check the Move objects the bitboard backend
+builds as well as its packed moves.
+"""
+import argparse
+import json
+import sys
+import time
+
+import ChessBitboard
+import ChessEngine
+
+BACKENDS = {"mailbox": ChessEngine.GameState, "bitboard": ChessBitboard.BitboardGameState}
+
+#(name, FEN, {depth: node count}) - counts from the chessprogramming wiki perft results page
+POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+
+'''
+Number of leaf nodes depth plies below the current position. The bitboard backend counts on packed moves without
+building Move objects, see BitboardGameState.perft
+'''
+def perft(gs, depth):
+    if isinstance(gs, ChessBitboard.BitboardGameState):
+        return gs.perft(depth)
+    return perft_moves(gs, depth)
+
+
+'''
+perft through get_valid_moves/make_move/undo_move, works with any GameState
+'''
+def perft_moves(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft_moves(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+'''
+Perft split by root move, returns a dict of move notation -> leaf nodes under that move
+'''
+def divide(gs, depth):
+    counts = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        counts[move.get_chess_notation()] = perft(gs, depth - 1)
+        gs.undo_move()
+    return counts
+
+
+'''
+Runs perft on one position and times it
+'''
+def run_position(name, fen, expected, depth, backend="bitboard", moves=False):
+    gs = BACKENDS[backend]()
+    gs.load_fen(fen)
+    depth = max(min(depth, max(expected)), min(expected)) #only depths with a published count
+    startTime = time.perf_counter()
+    nodes = perft_moves(gs, depth) if moves else perft(gs, depth)
+    seconds = time.perf_counter() - startTime
+    return {"position": name, "fen": fen, "depth": depth, "nodes": nodes, "expected": expected[depth],
+            "passed": nodes == expected[depth], "seconds": round(seconds, 4),
+            "nps": int(nodes / seconds) if seconds > 0 else 0}
+
+
+def run_suite(depth, backend="bitboard", names=None, moves=False):
+    results = []
+    for name, fen, expected in POSITIONS:
+        if names is None or name in names:
+            results.append(run_position(name, fen, expected, depth, backend, moves))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft move generation test and benchmark")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    parser.add_argument("--position", action="append", help="reference position name, can be repeated")
+    parser.add_argument("--fen", help="run divide on this position instead of the reference suite")
+    parser.add_argument("--moves", action="store_true", help="count through Move objects on every backend")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+
+    if args.fen:
+        gs = BACKENDS[args.backend]()
+        gs.load_fen(args.fen)
+        counts = divide(gs, args.depth)
+        if args.json:
+            print(json.dumps({"fen": args.fen, "depth": args.depth, "moves": counts, "nodes": sum(counts.values())}))
+        else:
+            for notation in sorted(counts):
+                print(notation + ": " + str(counts[notation]))
+            print("nodes: " + str(sum(counts.values())))
+        return 0
+
+    results = run_suite(args.depth, args.backend, args.position, args.moves)
+    totalNodes = sum(r["nodes"] for r in results)
+    totalSeconds = sum(r["seconds"] for r in results)
+    passed = all(r["passed"] for r in results)
+    if args.json:
+        print(json.dumps({"backend": args.backend, "python": sys.version.split()[0], "results": results,
+                          "nodes": totalNodes, "seconds": round(totalSeconds, 4),
+                          "nps": int(totalNodes / totalSeconds) if totalSeconds > 0 else 0, "passed": passed}))
+    else:
+        for r in results:
+            print("%-10s depth %d  nodes %10d  expected %10d  %s  %8.3fs  %9d nps" % (
+                r["position"], r["depth"], r["nodes"], r["expected"], "ok  " if r["passed"] else "FAIL",
+                r["seconds"], r["nps"]))
+        print("total nodes %d in %.3fs (%d nps)" % (totalNodes, totalSeconds,
+                                                   totalNodes / totalSeconds if totalSeconds > 0 else 0))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
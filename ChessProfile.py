@@ -0,0 +1,198 @@
+"""
+Opt-in profiling of the engine's hot paths. While a Profiler is enabled the methods listed in TARGETS are replaced
+by wrappers that count calls and add up wall time, and every search adds its transposition table probes and hits.
+When it is disabled the original methods are put back, so the engine pays nothing for it otherwise.
+
+    with ChessProfile.Profiler() as profiler:
+        ChessPerft.perft(gs, 4)
+    print(profiler.to_json())
+
+or from the command line:
+
+    python ChessProfile.py --mode search --depth 4 --json
+
+Times are inclusive, e.g. get_valid_moves includes the check_pins_checks and per-piece generator calls it makes.
+"""
+import argparse
+import functools
+import json
+import sys
+import time
+import weakref
+
+import ChessBitboard
+import ChessEngine
+import ChessPerft
+import ChessSearch
+
+#(class, method names) wrapped while profiling
+TARGETS = [
+    (ChessEngine.GameState, ["get_valid_moves", "generate_valid_moves", "get_all_possible_moves",
+                             "check_pins_checks", "get_pawn_moves", "get_rook_moves", "get_bishop_moves",
+                             "get_knight_moves", "get_queen_moves", "get_king_moves", "get_attacked_squares",
+                             "make_move", "undo_move"]),
+    (ChessBitboard.BitboardGameState, ["generate_valid_moves", "attackers_to", "make_move", "undo_move",
+                                       "legal_targets", "generate_packed_moves", "count_legal_moves",
+                                       "make_packed", "undo_packed"]),
+    (ChessEngine.Move, ["__init__"]),
+]
+
+
+class Profiler():
+    def __init__(self):
+        self.enabled = False
+        self.originals = [] #(class, name, original function) to put back on disable
+        self.states = weakref.WeakSet() #game states whose moveFunctions point at the wrappers
+        self.calls = {}
+        self.seconds = {}
+        self.reset()
+
+    '''
+    Zeroes the recorded numbers, cleared in place since the active wrappers hold these dicts
+    '''
+    def reset(self):
+        self.calls.clear()
+        self.seconds.clear()
+        self.searches = 0
+        self.nodes = 0
+        self.ttProbes = 0
+        self.ttHits = 0
+
+    '''
+    Starts recording. moveFunctions holds bound methods made in GameState.__init__, so states created before this
+    call only record their per-piece generators if they are passed in states. States created while recording are
+    tracked so disable can point them back at the original methods
+    '''
+    def enable(self, states=()):
+        if self.enabled:
+            return
+        self.enabled = True
+        for cls, names in TARGETS:
+            for name in names:
+                self.wrap(cls, name, self.timed(cls.__name__ + "." + name, cls.__dict__[name]))
+        self.wrap(ChessSearch.Search, "search", self.counted_search(ChessSearch.Search.__dict__["search"]))
+        self.wrap(ChessEngine.GameState, "__init__", self.tracked_init(ChessEngine.GameState.__dict__["__init__"]))
+        for gs in states:
+            self.attach(gs)
+
+    '''
+    Stops recording and restores the original methods, the recorded numbers are kept
+    '''
+    def disable(self):
+        if not self.enabled:
+            return
+        for cls, name, function in reversed(self.originals):
+            setattr(cls, name, function)
+        self.originals = []
+        self.enabled = False
+        for gs in list(self.states):
+            self.attach(gs)
+        self.states = weakref.WeakSet()
+
+    '''
+    Points gs.moveFunctions at the methods currently on the class, wrapped or not
+    '''
+    def attach(self, gs):
+        gs.moveFunctions = {piece: getattr(gs, function.__name__) for piece, function in gs.moveFunctions.items()}
+        if self.enabled:
+            self.states.add(gs)
+
+    def wrap(self, cls, name, wrapper):
+        self.originals.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, wrapper)
+
+    def timed(self, label, function):
+        calls = self.calls
+        seconds = self.seconds
+        perf_counter = time.perf_counter
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                #get() rather than a key made up front, reset() can empty the dicts mid-run
+                seconds[label] = seconds.get(label, 0.0) + perf_counter() - start
+                calls[label] = calls.get(label, 0) + 1
+        return wrapper
+
+    def tracked_init(self, function):
+        @functools.wraps(function)
+        def wrapper(gs, *args, **kwargs):
+            function(gs, *args, **kwargs)
+            self.states.add(gs)
+        return wrapper
+
+    def counted_search(self, function):
+        @functools.wraps(function)
+        def wrapper(search, *args, **kwargs):
+            probes = search.tt.probes
+            hits = search.tt.hits
+            try:
+                return function(search, *args, **kwargs)
+            finally:
+                self.searches += 1
+                self.nodes += search.nodes
+                self.ttProbes += search.tt.probes - probes
+                self.ttHits += search.tt.hits - hits
+        return wrapper
+
+    '''
+    Recorded numbers as a dict, functions sorted by total time
+    '''
+    def report(self):
+        functions = {}
+        for label in sorted(self.calls, key=lambda label: -self.seconds[label]):
+            calls = self.calls[label]
+            if calls:
+                functions[label] = {"calls": calls, "seconds": round(self.seconds[label], 6),
+                                    "usPerCall": round(self.seconds[label] / calls * 1e6, 3)}
+        return {"functions": functions,
+                "search": {"searches": self.searches, "nodes": self.nodes, "ttProbes": self.ttProbes,
+                           "ttHits": self.ttHits,
+                           "ttHitRate": round(self.ttHits / self.ttProbes, 4) if self.ttProbes else 0.0}}
+
+    def to_json(self, indent=None):
+        return json.dumps(self.report(), indent=indent)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.disable()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile move generation and search")
+    parser.add_argument("--mode", choices=["perft", "search"], default="perft")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--backend", choices=sorted(ChessPerft.BACKENDS), default="bitboard")
+    parser.add_argument("--fen", default=ChessPerft.POSITIONS[0][1])
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    profiler = Profiler()
+    with profiler:
+        gs = ChessPerft.BACKENDS[args.backend]()
+        gs.load_fen(args.fen)
+        if args.mode == "perft":
+            ChessPerft.perft(gs, args.depth)
+        else:
+            ChessSearch.Search(gs).search(args.depth)
+    if args.json:
+        print(profiler.to_json())
+        return 0
+    report = profiler.report()
+    print("%-40s %10s %10s %10s" % ("function", "calls", "seconds", "us/call"))
+    for label, stats in report["functions"].items():
+        print("%-40s %10d %10.3f %10.2f" % (label, stats["calls"], stats["seconds"], stats["usPerCall"]))
+    search = report["search"]
+    if search["searches"]:
+        print("searches %d  nodes %d  tt probes %d  hits %d  hit rate %.1f%%" % (
+            search["searches"], search["nodes"], search["ttProbes"], search["ttHits"], search["ttHitRate"] * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
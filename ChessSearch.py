@@ -0,0 +1,297 @@
+"""
+Move search for the engine. Negamax alpha-beta with iterative deepening, a transposition table keyed by
+GameState.zobristKey, and move ordering (hash move, MVV-LVA captures, killer moves, history heuristic).
+The search stops when it runs out of its time or node budget and returns the best move of the deepest finished iteration.
+Leaves are scored by ChessEvaluation.evaluate from totals GameState keeps up to date, so nothing rescans the board.
+"""
+import time
+
+import ChessEvaluation
+
+PIECE_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+CHECKMATE = 100000
+MAX_PLY = 128
+INFINITY = CHECKMATE + 1
+
+#transposition table entry bounds
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+#move ordering scores, higher is searched first
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 20
+KILLER_SCORE = 1 << 19
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class TranspositionTable():
+    '''
+    Fixed number of slots, a key always maps to slot key % size. A new entry replaces the old one when the old
+    one is from an earlier search, is for the same position, or was searched to a lower or equal depth.
+    '''
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.keys = [None] * size
+        self.entries = [None] * size #(depth, score, bound, bestMoveID, age)
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        self.probes += 1
+        index = key % self.size
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.entries[index]
+        return None
+
+    def store(self, key, depth, score, bound, bestMoveID):
+        index = key % self.size
+        old = self.entries[index]
+        if old is None or self.keys[index] == key or old[4] != self.age or depth >= old[0]:
+            self.keys[index] = key
+            self.entries[index] = (depth, score, bound, bestMoveID, self.age)
+
+    '''
+    Call at the start of every search so entries from old searches get replaced first
+    '''
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.entries = [None] * self.size
+        self.probes = 0
+        self.hits = 0
+
+
+class Search():
+    def __init__(self, gs, tt=None, evaluator=ChessEvaluation.evaluate, stopEvent=None):
+        self.gs = gs
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.evaluate = evaluator
+        self.stopEvent = stopEvent #threading or multiprocessing Event, the search stops once it is set
+        self.stopped = False
+        self.nodes = 0
+
+    '''
+    Ask a running search to stop, safe to call from another thread
+    '''
+    def stop(self):
+        self.stopped = True
+
+    '''
+    Iterative deepening search. Stops at maxDepth, after timeLimit seconds or after nodeLimit nodes, whichever
+    comes first. onIteration(depth, score, nodes, seconds, pv) is called after every finished depth.
+    Returns (bestMove, score), bestMove is None when there are no legal moves.
+    '''
+    def search(self, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, onIteration=None):
+        gs = self.gs
+        self.stopped = False
+        self.nodes = 0
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = {}
+        self.moveLists = [[] for _ in range(MAX_PLY)] #one list per ply, refilled instead of reallocated
+        self.tt.new_search()
+        self.completedDepth = 0
+        rootMoves = gs.get_valid_moves()
+        if len(rootMoves) == 0:
+            return None, -CHECKMATE if gs.inCheck else 0
+        bestMove, bestScore = rootMoves[0], 0
+        logLength = len(gs.moveLog)
+        for depth in range(1, maxDepth + 1):
+            try:
+                score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                while len(gs.moveLog) > logLength: #unwind the moves the aborted search had made
+                    gs.undo_move()
+                break
+            bestMove, bestScore = self.rootBestMove, score
+            self.completedDepth = depth
+            elapsed = time.perf_counter() - self.startTime
+            if onIteration is not None:
+                onIteration(depth, bestScore, self.nodes, elapsed, self.get_pv(depth))
+            if abs(score) >= CHECKMATE - MAX_PLY: #found a forced mate, deeper search won't change it
+                break
+            #the next iteration takes several times longer than this one, don't start what can't finish
+            if self.deadline is not None and self.startTime + 2 * elapsed > self.deadline:
+                break
+        return bestMove, bestScore
+
+    def check_budget(self):
+        if self.stopped or (self.stopEvent is not None and self.stopEvent.is_set()) or \
+                (self.deadline is not None and time.perf_counter() >= self.deadline) or \
+                (self.nodeLimit is not None and self.nodes >= self.nodeLimit):
+            self.stopped = True
+            raise SearchAborted()
+
+    def negamax(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.check_budget()
+        gs = self.gs
+        if ply > 0 and (gs.get_repetition_count() > 1 or gs.halfmoveClock >= 100): #repetition or fifty moves
+            return 0
+        if depth <= 0:
+            return self.quiescence(alpha, beta, ply)
+
+        key = gs.zobristKey
+        hashMoveID = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            hashMoveID = entry[3]
+            if ply > 0 and entry[0] >= depth:
+                score = score_from_tt(entry[1], ply)
+                if entry[2] == EXACT:
+                    return score
+                if entry[2] == LOWER_BOUND and score >= beta:
+                    return score
+                if entry[2] == UPPER_BOUND and score <= alpha:
+                    return score
+
+        moves = gs.get_valid_moves(self.moveLists[ply])
+        if len(moves) == 0:
+            return -CHECKMATE + ply if gs.inCheck else 0
+        self.order_moves(moves, hashMoveID, ply)
+
+        alphaStart = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        for move in moves:
+            gs.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if ply == 0:
+                    self.rootBestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.pieceCaptured == "--": #quiet move caused a cutoff, remember it
+                            killers = self.killers[ply]
+                            if killers[0] != move.moveID:
+                                killers[1] = killers[0]
+                                killers[0] = move.moveID
+                            historyKey = (move.pieceMoved, move.end)
+                            self.history[historyKey] = self.history.get(historyKey, 0) + depth * depth
+                        break
+
+        if bestScore <= alphaStart:
+            bound = UPPER_BOUND
+        elif bestScore >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, score_to_tt(bestScore, ply), bound, bestMove.moveID)
+        return bestScore
+
+    '''
+    Search captures only until the position is quiet, so the evaluation isn't taken in the middle of an exchange
+    '''
+    def quiescence(self, alpha, beta, ply):
+        gs = self.gs
+        standPat = self.evaluate(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        if ply >= MAX_PLY - 1:
+            return standPat
+        #underpromotions are left to the main search
+        captures = [move for move in gs.get_valid_moves(self.moveLists[ply])
+                    if (move.pieceCaptured != "--" or move.isPawnPromotion) and move.promotionPiece in (None, "Q")]
+        captures.sort(key=mvv_lva, reverse=True)
+        for move in captures:
+            self.nodes += 1
+            if self.nodes & 255 == 0:
+                self.check_budget()
+            gs.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def order_moves(self, moves, hashMoveID, ply):
+        killers = self.killers[ply]
+        history = self.history
+        def score(move):
+            if move.moveID == hashMoveID:
+                return HASH_MOVE_SCORE
+            if move.pieceCaptured != "--" or move.isPawnPromotion:
+                return CAPTURE_SCORE + mvv_lva(move)
+            if move.moveID == killers[0] or move.moveID == killers[1]:
+                return KILLER_SCORE
+            return history.get((move.pieceMoved, move.end), 0)
+        moves.sort(key=score, reverse=True)
+
+    '''
+    Principal variation read back out of the transposition table
+    '''
+    def get_pv(self, depth):
+        gs = self.gs
+        pv = []
+        for _ in range(depth):
+            entry = self.tt.probe(gs.zobristKey)
+            if entry is None:
+                break
+            found = None
+            for move in gs.get_valid_moves():
+                if move.moveID == entry[3]:
+                    found = move
+                    break
+            if found is None:
+                break
+            pv.append(found)
+            gs.make_move(found)
+        for _ in pv:
+            gs.undo_move()
+        return pv
+
+
+'''
+Most valuable victim, least valuable attacker
+'''
+def mvv_lva(move):
+    victim = PIECE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+    if move.isPawnPromotion:
+        victim += PIECE_VALUES[move.promotionPiece]
+    return 10 * victim - PIECE_VALUES[move.pieceMoved[1]]
+
+
+#mate scores are stored relative to the node so they stay correct when the position is reached at another ply
+def score_to_tt(score, ply):
+    if score >= CHECKMATE - MAX_PLY:
+        return score + ply
+    if score <= -CHECKMATE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= CHECKMATE - MAX_PLY:
+        return score - ply
+    if score <= -CHECKMATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+'''
+Convenience wrapper, returns the best move for gs or None if there are no legal moves
+'''
+def find_best_move(gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, tt=None):
+    if maxDepth == MAX_PLY and timeLimit is None and nodeLimit is None:
+        maxDepth = 4
+    bestMove, score = Search(gs, tt).search(maxDepth, timeLimit, nodeLimit)
+    return bestMove
@@ -0,0 +1,332 @@
+"""
+Game server hosting many games at once over TCP with asyncio. Clients send one JSON object per line and get one JSON
+object per line back, answers carry the request's "id" so a client can have several requests in flight:
+
+    {"id": 1, "op": "new"}                                   -> {"id": 1, "ok": true, "game": "9f2c...", "fen": ...}
+    {"id": 2, "op": "move", "game": "9f2c...", "move": "e2e4"}
+    {"id": 3, "op": "go", "game": "9f2c...", "movetime": 1.0, "play": true}
+
+ops: new [fen], move <move>, undo, state, legal, go [depth] [movetime] [nodes] [play], close, stats.
+Moves are in UCI notation (e2e4, e7e8n). Engine searches run on a pool of worker processes so one search never holds
+up the other games. A game is stored as its start FEN and its moves packed into 16 bits each, only the most recently
+used games also keep a live GameState. Games nobody has used for --idle-timeout seconds are closed, so clients that
+go away without "close" don't fill the server up. With --book, "go" answers positions in the opening book with a book
+move instead of searching, the response then has "book": true. Start it with:
+
+    python ChessServer.py --port 8765 --workers 4 --idle-timeout 1800 --book book.bin
+"""
+import argparse
+import array
+import asyncio
+import concurrent.futures
+import json
+import math
+import secrets
+import sys
+import time
+from collections import OrderedDict
+
+import ChessBitboard
+import ChessBook
+import ChessEngine
+import ChessSearch
+import ChessUCI
+
+DEFAULT_PORT = 8765
+MAX_GAMES = 10000
+LIVE_STATES = 256 #games that keep a GameState, the rest are replayed from their moves when used
+MAX_MOVETIME = 10.0 #longest search a client can ask for, in seconds
+DEFAULT_MOVETIME = 1.0
+MAX_LINE = 64 * 1024
+IDLE_TIMEOUT = 30 * 60.0 #seconds a game is kept without any request for it
+MOVE_CACHE_SIZE = 4 #positions whose legal moves each live game remembers
+
+#set once per worker process by init_worker
+_worker = {}
+
+
+def init_worker(bookPath=None):
+    _worker["gs"] = ChessBitboard.BitboardGameState()
+    _worker["tt"] = ChessSearch.TranspositionTable()
+    #every worker maps the same file, the OS keeps one copy of it
+    _worker["book"] = ChessBook.OpeningBook(bookPath) if bookPath is not None else None
+
+
+'''
+Runs in a worker process, returns (packed best move or None, score, depth, nodes, book move or not). The game is
+replayed from its start so the search knows which positions already occurred and can avoid repetitions
+'''
+def search_task(startFen, packedMoves, maxDepth, timeLimit, nodeLimit):
+    gs = _worker["gs"]
+    gs.load_fen(startFen)
+    for packed in packedMoves:
+        gs.make_move(ChessEngine.Move.unpack(packed, gs.board))
+    book = _worker.get("book")
+    bookMove = book.choose_move(gs) if book is not None else None
+    if bookMove is not None:
+        return bookMove.pack(), 0, 0, 0, True
+    search = ChessSearch.Search(gs, _worker["tt"])
+    bestMove, score = search.search(maxDepth, timeLimit, nodeLimit)
+    return (bestMove.pack() if bestMove is not None else None), score, search.completedDepth, search.nodes, False
+
+
+class Game():
+    #one of these per hosted game, kept small since there can be thousands
+    __slots__ = ("startFen", "moves", "lastUsed")
+
+    def __init__(self, startFen):
+        self.startFen = startFen
+        self.moves = array.array("H") #Move.pack() of every move played
+        self.lastUsed = time.monotonic()
+
+
+class GameServer():
+    def __init__(self, pool=None, maxGames=MAX_GAMES, liveStates=LIVE_STATES, idleTimeout=IDLE_TIMEOUT):
+        self.pool = pool #executor for engine searches, searches are refused without one
+        self.maxGames = maxGames
+        self.liveStates = liveStates
+        self.idleTimeout = idleTimeout
+        self.games = {} #game id -> Game
+        self.states = OrderedDict() #game id -> GameState in sync with the game, least recently used first
+        self.searches = 0
+
+    @staticmethod
+    def new_state(fen):
+        gs = ChessBitboard.BitboardGameState()
+        gs.load_fen(fen)
+        #a request usually asks for the moves of the position the last one did, "legal" and then "move"
+        gs.enable_move_cache(MOVE_CACHE_SIZE)
+        return gs
+
+    '''
+    GameState at the game's current position, replayed from the start position if it isn't live
+    '''
+    def get_state(self, gameID):
+        gs = self.states.get(gameID)
+        if gs is not None:
+            self.states.move_to_end(gameID)
+            return gs
+        game = self.games[gameID]
+        gs = self.new_state(game.startFen)
+        for packed in game.moves:
+            gs.make_move(ChessEngine.Move.unpack(packed, gs.board))
+        self.states[gameID] = gs
+        if len(self.states) > self.liveStates:
+            self.states.popitem(last=False)
+        return gs
+
+    def get_game(self, request):
+        gameID = request.get("game")
+        if gameID not in self.games:
+            raise ValueError("unknown game: %s" % gameID)
+        game = self.games[gameID]
+        game.lastUsed = time.monotonic()
+        return gameID, game
+
+    '''
+    Closes the games that haven't been used for idleTimeout seconds, returns how many
+    '''
+    def expire_idle(self, now=None):
+        cutoff = (time.monotonic() if now is None else now) - self.idleTimeout
+        expired = [gameID for gameID, game in self.games.items() if game.lastUsed < cutoff]
+        for gameID in expired:
+            del self.games[gameID]
+            self.states.pop(gameID, None)
+        return len(expired)
+
+    '''
+    Runs expire_idle every so often until cancelled
+    '''
+    async def expire_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idleTimeout / 10))
+            self.expire_idle()
+
+    '''
+    "checkmate", "stalemate", "repetition", "fifty" or "ongoing", along with the legal moves
+    '''
+    @staticmethod
+    def get_status(gs):
+        moves = gs.get_valid_moves()
+        if len(moves) == 0:
+            return ("checkmate" if gs.inCheck else "stalemate"), moves
+        if gs.get_repetition_count() >= 3:
+            return "repetition", moves
+        if gs.halfmoveClock >= 100:
+            return "fifty", moves
+        return "ongoing", moves
+
+    def describe(self, gs):
+        status, moves = self.get_status(gs)
+        result = {"fen": gs.get_fen(), "status": status, "inCheck": gs.inCheck}
+        if gs.moveLog:
+            result["lastMove"] = ChessUCI.uci_move(gs.moveLog[-1])
+        return result
+
+    '''
+    Answers one request, returns the response dict. Engine searches are awaited on the worker pool
+    '''
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "new":
+            if len(self.games) >= self.maxGames:
+                raise ValueError("server is full")
+            gs = self.new_state(request.get("fen", ChessUCI.START_FEN))
+            #describe generates the moves, so a position the engine can't play raises before the game is registered
+            result = self.describe(gs)
+            gameID = secrets.token_hex(8)
+            self.games[gameID] = Game(gs.get_fen())
+            self.states[gameID] = gs
+            if len(self.states) > self.liveStates:
+                self.states.popitem(last=False)
+            return dict(result, game=gameID)
+        if op == "stats":
+            return {"games": len(self.games), "live": len(self.states), "searches": self.searches}
+        gameID, game = self.get_game(request)
+        if op == "move":
+            gs = self.get_state(gameID)
+            self.play(gs, game, request.get("move"))
+            return self.describe(gs)
+        if op == "undo":
+            gs = self.get_state(gameID)
+            if not game.moves:
+                raise ValueError("no move to undo")
+            gs.undo_move()
+            game.moves.pop()
+            return self.describe(gs)
+        if op == "state":
+            gs = self.get_state(gameID)
+            return dict(self.describe(gs), startFen=game.startFen, moves=[ChessUCI.uci_move(m) for m in gs.moveLog])
+        if op == "legal":
+            return {"moves": [ChessUCI.uci_move(m) for m in self.get_state(gameID).get_valid_moves()]}
+        if op == "go":
+            return await self.go(gameID, game, request)
+        if op == "close":
+            del self.games[gameID]
+            self.states.pop(gameID, None)
+            return {}
+        raise ValueError("unknown op: %s" % op)
+
+    def play(self, gs, game, notation):
+        for move in gs.get_valid_moves():
+            if ChessUCI.uci_move(move) == notation:
+                gs.make_move(move)
+                game.moves.append(move.pack())
+                return move
+        raise ValueError("illegal move: %s" % notation)
+
+    async def go(self, gameID, game, request):
+        if self.pool is None:
+            raise ValueError("no engine available")
+        #a worker process is shared by every game, so each search has to stay within the limits
+        maxDepth = max(1, min(int(request.get("depth", ChessSearch.MAX_PLY)), ChessSearch.MAX_PLY))
+        timeLimit = float(request.get("movetime", DEFAULT_MOVETIME))
+        if not math.isfinite(timeLimit) or timeLimit <= 0:
+            raise ValueError("movetime must be a positive number of seconds")
+        timeLimit = min(timeLimit, MAX_MOVETIME)
+        nodeLimit = int(request["nodes"]) if "nodes" in request else None
+        if nodeLimit is not None and nodeLimit <= 0:
+            raise ValueError("nodes must be positive")
+        gs = self.get_state(gameID)
+        key = gs.zobristKey
+        self.searches += 1
+        #the moves are copied, the pool pickles its arguments later and the game can change in between
+        packed, score, depth, nodes, book = await asyncio.get_running_loop().run_in_executor(
+            self.pool, search_task, game.startFen, game.moves.tolist(), maxDepth, timeLimit, nodeLimit)
+        result = {"score": score, "depth": depth, "nodes": nodes, "move": None, "book": book}
+        if packed is None:
+            return result
+        #the game can change while the engine thinks (an undo and another move keeps the length), only play the move
+        #on the position it was found for
+        if self.games.get(gameID) is not game:
+            raise ValueError("position changed during the search")
+        gs = self.get_state(gameID)
+        if gs.zobristKey != key:
+            raise ValueError("position changed during the search")
+        notation = ChessUCI.uci_move(ChessEngine.Move.unpack(packed, gs.board))
+        result["move"] = notation
+        if request.get("play"):
+            self.play(gs, game, notation)
+            result.update(self.describe(gs))
+        return result
+
+    '''
+    Serves one client connection, requests are handled concurrently so a long search doesn't block the others
+    '''
+    async def serve_client(self, reader, writer):
+        tasks = set()
+        lock = asyncio.Lock()
+        async def answer(request):
+            requestID = request.get("id") if isinstance(request, dict) else None
+            try:
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+                response = dict(await self.handle(request), ok=True)
+            #a bad request shouldn't drop the connection, OverflowError is int() of an infinite number
+            except (ValueError, KeyError, IndexError, TypeError, OverflowError) as e:
+                response = {"ok": False, "error": str(e)}
+            response["id"] = requestID
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                task = asyncio.ensure_future(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port, workers, idleTimeout=IDLE_TIMEOUT, bookPath=None):
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(bookPath,)) as pool:
+        server = GameServer(pool, idleTimeout=idleTimeout)
+        tcpServer = await asyncio.start_server(server.serve_client, host, port, limit=MAX_LINE)
+        sys.stderr.write("serving on %s:%d\n" % (host, port))
+        expiry = asyncio.ensure_future(server.expire_loop())
+        try:
+            async with tcpServer:
+                await tcpServer.serve_forever()
+        finally:
+            expiry.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many chess games over TCP, one JSON request per line")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="engine processes, defaults to the number of CPUs")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds a game is kept without requests before it is closed")
+    parser.add_argument("--book", default=None, help="opening book built with ChessBook.py")
+    args = parser.parse_args(argv)
+    if not args.idle_timeout > 0:
+        parser.error("--idle-timeout must be positive")
+    if args.book is not None: #fail here rather than in every worker
+        try:
+            ChessBook.OpeningBook(args.book).close()
+        except (OSError, ValueError) as e:
+            parser.error("can't open book: %s" % e)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.idle_timeout, args.book))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+UCI (Universal Chess Interface) front end, reads commands on stdin and answers on stdout so the engine can run under
+any UCI GUI or tournament manager without a display. Searches run on a background thread, so "stop" is handled
+while the engine is thinking. With the BookFile option set to a book from ChessBook.py, positions in the book are
+answered from it without searching.
+
+    python ChessUCI.py
+"""
+import sys
+import threading
+
+import ChessBitboard
+import ChessBook
+import ChessEngine
+import ChessSearch
+
+ENGINE_NAME = "Python_Chess"
+ENGINE_AUTHOR = "Python_Chess contributors"
+START_FEN = ChessEngine.START_FEN
+DEFAULT_HASH_MB = 16
+TT_ENTRY_BYTES = 128 #rough size of one transposition table slot
+MOVE_OVERHEAD = 0.05 #seconds kept back for communication
+
+
+'''
+Move in UCI notation, e.g. "e2e4" or "e7e8q"
+'''
+def uci_move(move):
+    notation = move.get_chess_notation()
+    if move.isPawnPromotion:
+        notation += move.promotionPiece.lower()
+    return notation
+
+
+class UCIEngine():
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outLock = threading.Lock()
+        self.gs = ChessBitboard.BitboardGameState()
+        self.tt = ChessSearch.TranspositionTable(DEFAULT_HASH_MB * 1024 * 1024 // TT_ENTRY_BYTES)
+        self.stopEvent = threading.Event()
+        self.releaseEvent = threading.Event() #set once bestmove may be sent, held back by go infinite/ponder
+        self.ponderTimeLimit = None #time to use once a ponder search becomes a real one
+        self.ponderTimer = None
+        self.searchThread = None
+        self.book = None #ChessBook.OpeningBook from the BookFile option
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    '''
+    Handles one command line, returns False on "quit"
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 4096" % DEFAULT_HASH_MB)
+            self.send("option name BookFile type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            self.tt.clear()
+        elif command == "setoption":
+            self.set_option(tokens)
+        elif command == "position":
+            self.stop()
+            self.set_position(tokens)
+        elif command == "go":
+            self.stop()
+            self.go(tokens)
+        elif command == "ponderhit":
+            self.ponder_hit()
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, tokens):
+        if "name" in tokens and "value" in tokens:
+            name = " ".join(tokens[tokens.index("name") + 1:tokens.index("value")])
+            value = " ".join(tokens[tokens.index("value") + 1:])
+            if name.lower() == "hash":
+                try:
+                    megabytes = max(1, int(value))
+                except ValueError:
+                    self.send("info string invalid Hash value " + value)
+                    return
+                self.stop()
+                self.tt = ChessSearch.TranspositionTable(megabytes * 1024 * 1024 // TT_ENTRY_BYTES)
+            elif name.lower() == "bookfile":
+                self.stop()
+                if self.book is not None:
+                    self.book.close()
+                    self.book = None
+                if value and value != "<empty>":
+                    try:
+                        self.book = ChessBook.OpeningBook(value)
+                    except (OSError, ValueError) as e:
+                        self.send("info string can't open book %s: %s" % (value, e))
+
+    '''
+    position [startpos | fen <fen>] [moves <move> ...]
+    '''
+    def set_position(self, tokens):
+        movesIndex = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if len(tokens) > 1 and tokens[1] == "fen":
+            fen = " ".join(tokens[2:movesIndex])
+        else:
+            fen = START_FEN
+        gs = ChessBitboard.BitboardGameState()
+        try:
+            gs.load_fen(fen)
+        except ValueError as e: #keep the previous position, a bad FEN shouldn't take the engine down
+            self.send("info string " + str(e))
+            return
+        for notation in tokens[movesIndex + 1:]:
+            for move in gs.get_valid_moves():
+                if uci_move(move) == notation:
+                    gs.make_move(move)
+                    break
+            else:
+                self.send("info string illegal move " + notation)
+                break
+        self.gs = gs
+
+    def go(self, tokens):
+        limits = {}
+        infinite = "infinite" in tokens
+        ponder = "ponder" in tokens
+        i = 1
+        while i < len(tokens):
+            if tokens[i] in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes") and \
+                    i + 1 < len(tokens):
+                try:
+                    limits[tokens[i]] = int(tokens[i + 1])
+                except ValueError:
+                    self.send("info string ignoring invalid %s value %s" % (tokens[i], tokens[i + 1]))
+                i += 2
+            else:
+                i += 1
+        if len(tokens) == 1: #a bare go searches until stop, like go infinite
+            infinite = True
+        #a book move is answered right away, except when the GUI wants the engine thinking until it says stop
+        if self.book is not None and not (infinite or ponder):
+            move = self.book.choose_move(self.gs)
+            if move is not None:
+                self.send("info string book move")
+                self.send("bestmove " + uci_move(move))
+                return
+        maxDepth = limits.get("depth", ChessSearch.MAX_PLY)
+        nodeLimit = limits.get("nodes")
+        timeLimit = None
+        if "movetime" in limits:
+            timeLimit = max(0.01, limits["movetime"] / 1000 - MOVE_OVERHEAD)
+        else:
+            remaining = limits.get("wtime" if self.gs.whiteToMove else "btime")
+            if remaining is not None:
+                increment = limits.get("winc" if self.gs.whiteToMove else "binc", 0)
+                movesToGo = limits.get("movestogo", 30)
+                timeLimit = remaining / 1000 / max(1, movesToGo) + increment / 1000 * 0.8
+                timeLimit = max(0.01, min(timeLimit, remaining / 1000 / 2) - MOVE_OVERHEAD)
+        self.stopEvent.clear()
+        #in infinite and ponder mode bestmove waits for stop (or ponderhit), even if the search ends by itself
+        if infinite or ponder:
+            self.releaseEvent.clear()
+        else:
+            self.releaseEvent.set()
+        self.ponderTimeLimit = None
+        if ponder and not infinite: #search without a clock until ponderhit says the move was played
+            self.ponderTimeLimit = timeLimit
+            timeLimit = None
+        self.searchThread = threading.Thread(target=self.search, args=(maxDepth, timeLimit, nodeLimit), daemon=True)
+        self.searchThread.start()
+
+    '''
+    The opponent played the move we were pondering on, keep searching on our own clock from now on
+    '''
+    def ponder_hit(self):
+        if self.searchThread is None or self.releaseEvent.is_set():
+            return
+        if self.ponderTimeLimit is not None:
+            self.ponderTimer = threading.Timer(self.ponderTimeLimit, self.stopEvent.set)
+            self.ponderTimer.daemon = True
+            self.ponderTimer.start()
+        self.releaseEvent.set()
+
+    def search(self, maxDepth, timeLimit, nodeLimit):
+        search = ChessSearch.Search(self.gs, self.tt, stopEvent=self.stopEvent)
+        def on_iteration(depth, score, nodes, seconds, pv):
+            if abs(score) >= ChessSearch.CHECKMATE - ChessSearch.MAX_PLY:
+                plies = ChessSearch.CHECKMATE - abs(score)
+                scoreText = "mate %d" % ((plies + 1) // 2 if score > 0 else -((plies + 1) // 2))
+            else:
+                scoreText = "cp %d" % score
+            self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+                depth, scoreText, nodes, nodes / seconds if seconds > 0 else 0, seconds * 1000,
+                " ".join(uci_move(move) for move in pv)))
+        bestMove, score = search.search(maxDepth, timeLimit, nodeLimit, on_iteration)
+        self.releaseEvent.wait()
+        self.send("bestmove " + (uci_move(bestMove) if bestMove is not None else "0000"))
+
+    '''
+    Stops a running search and waits for it to report its best move
+    '''
+    def stop(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.releaseEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+        if self.ponderTimer is not None:
+            self.ponderTimer.cancel()
+            self.ponderTimer = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
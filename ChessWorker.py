@@ -0,0 +1,107 @@
+"""
+Runs the engine in a separate process so the pygame window keeps drawing and taking input while the engine thinks.
+The UI submits positions and polls for messages between frames:
+
+    ("info", requestID, depth, score, nodes, seconds) - after every finished search depth
+    ("bestmove", requestID, packedMove, score) - the search is done, packedMove is None when there are no legal moves
+
+Messages for a request that has since been cancelled or replaced are dropped by poll(). Given an opening book, positions
+in it get a book move without a search, reported as a bestmove with score 0 and no info messages.
+"""
+import multiprocessing
+import queue
+
+import ChessBitboard
+import ChessBook
+import ChessEngine
+import ChessSearch
+
+
+'''
+Entry point of the engine process, handles one search request at a time until it gets None
+'''
+def engine_loop(requests, results, stopEvent, bookPath=None):
+    gs = ChessBitboard.BitboardGameState()
+    tt = ChessSearch.TranspositionTable()
+    book = ChessBook.OpeningBook(bookPath) if bookPath is not None else None
+    while True:
+        request = requests.get()
+        try: #skip requests that were already replaced by newer ones
+            while request is not None:
+                request = requests.get_nowait()
+        except queue.Empty:
+            pass
+        if request is None:
+            return
+        requestID, startFen, packedMoves, maxDepth, timeLimit, nodeLimit = request
+        stopEvent.clear()
+        #replayed from the start so the search knows which positions already occurred and can avoid repetitions
+        gs.load_fen(startFen)
+        for packed in packedMoves:
+            gs.make_move(ChessEngine.Move.unpack(packed, gs.board))
+        bookMove = book.choose_move(gs) if book is not None else None
+        if bookMove is not None:
+            results.put(("bestmove", requestID, bookMove.pack(), 0))
+            continue
+        search = ChessSearch.Search(gs, tt, stopEvent=stopEvent)
+        def on_iteration(depth, score, nodes, seconds, pv):
+            results.put(("info", requestID, depth, score, nodes, seconds))
+        bestMove, score = search.search(maxDepth, timeLimit, nodeLimit, on_iteration)
+        results.put(("bestmove", requestID, bestMove.pack() if bestMove is not None else None, score))
+
+
+class EngineWorker():
+    def __init__(self, bookPath=None):
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.stopEvent = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=engine_loop,
+                                               args=(self.requests, self.results, self.stopEvent, bookPath),
+                                               daemon=True)
+        self.process.start()
+        self.nextID = 0
+        self.currentID = None #request whose messages poll() passes on
+
+    '''
+    Starts a search on the position in gs, any search still running is abandoned. Returns the request ID
+    '''
+    def submit(self, gs, maxDepth=ChessSearch.MAX_PLY, timeLimit=None, nodeLimit=None):
+        self.cancel()
+        self.nextID += 1
+        self.currentID = self.nextID
+        self.requests.put((self.currentID, gs.startFen, [move.pack() for move in gs.moveLog], maxDepth, timeLimit,
+                           nodeLimit))
+        return self.currentID
+
+    '''
+    Stops the running search, its result will not be reported
+    '''
+    def cancel(self):
+        if self.currentID is not None:
+            self.stopEvent.set()
+            self.currentID = None
+
+    def is_thinking(self):
+        return self.currentID is not None
+
+    '''
+    Messages from the engine for the current request, never blocks
+    '''
+    def poll(self):
+        messages = []
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return messages
+            if message[1] == self.currentID:
+                if message[0] == "bestmove":
+                    self.currentID = None
+                messages.append(message)
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()